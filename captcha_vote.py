@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Multi-sample CAPTCHA voting
+
+Several independent readings of the same CAPTCHA image are combined by a
+per-character vote. Readings that disagree inside a known confusion group
+(0/O/D, 5/S, ...) still support each other, and the vote's agreement gives
+a confidence score, so a doubtful answer can be replaced by a fresh image
+instead of being submitted and costing a failed login.
+"""
+
+import re
+from collections import Counter
+
+
+CAPTCHA_LENGTH = 6
+CAPTCHA_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+# Characters the solver is known to mix up
+CONFUSION_GROUPS = [
+    ('0', 'O', 'D'),
+    ('1', 'I', 'L'),
+    ('5', 'S'),
+    ('6', 'G', '8'),
+    ('8', 'B'),
+    ('2', 'Z'),
+    ('7', 'T', 'Y'),
+]
+
+# Weight of a vote for a confusable character
+CONFUSION_WEIGHT = 0.5
+
+CONFUSABLE = {}
+for group in CONFUSION_GROUPS:
+    for char in group:
+        CONFUSABLE.setdefault(char, set()).update(c for c in group if c != char)
+
+
+def clean_reading(text: str) -> str:
+    """Uppercase alphanumeric characters of a solver reply"""
+    return re.sub(r'[^A-Z0-9]', '', (text or '').upper())
+
+
+def is_valid_answer(answer: str) -> bool:
+    """Whether an answer has exactly CAPTCHA_LENGTH characters of CAPTCHA_ALPHABET"""
+    return bool(answer) and len(answer) == CAPTCHA_LENGTH and all(c in CAPTCHA_ALPHABET for c in answer)
+
+
+def vote(readings: list) -> dict:
+    """Combine readings into one answer with per-character and overall confidence
+    
+    Each character's confidence is its support (exact votes plus
+    CONFUSION_WEIGHT per confusable vote) as a share of all readings, and the
+    overall confidence is the weakest character's. Invalid readings count
+    against it, and confusion-pair splits count as partial agreement.
+    """
+    valid = [reading for reading in map(clean_reading, readings) if is_valid_answer(reading)]
+    if not valid:
+        return {'answer': None, 'confidence': 0.0, 'characters': [], 'readings': list(readings)}
+        
+    answer = []
+    characters = []
+    for position in range(CAPTCHA_LENGTH):
+        counts = Counter(reading[position] for reading in valid)
+        
+        def support(char):
+            confusable = sum(counts[other] for other in CONFUSABLE.get(char, ()))
+            return counts[char] + CONFUSION_WEIGHT * confusable, counts[char]
+            
+        best = max(counts, key=support)
+        answer.append(best)
+        characters.append(round(support(best)[0] / len(readings), 3))
+        
+    return {
+        'answer': ''.join(answer),
+        'confidence': min(characters),
+        'characters': characters,
+        'readings': list(readings),
+    }
+
+
+class CaptchaStats:
+    """Counts CAPTCHA outcomes across logins"""
+    
+    def __init__(self):
+        self.images = 0
+        self.readings = 0
+        self.low_confidence = 0
+        self.submitted = 0
+        self.accepted = 0
+        self.rejected = 0
+    
+    def record_vote(self, result: dict):
+        self.images += 1
+        self.readings += len(result['readings'])
+    
+    def record_refresh(self):
+        # Each low-confidence refresh replaces a submit that would likely have failed
+        self.low_confidence += 1
+    
+    def record_submit(self, accepted: bool):
+        self.submitted += 1
+        if accepted:
+            self.accepted += 1
+        else:
+            self.rejected += 1
+    
+    def success_rate(self) -> float:
+        return self.accepted / self.submitted if self.submitted else 0.0
+    
+    def summary(self) -> str:
+        return (f"{self.accepted}/{self.submitted} accepted ({self.success_rate():.0%}), "
+                f"{self.low_confidence} low-confidence images refreshed instead of submitted "
+                f"(login retries saved), {self.readings} readings for {self.images} images")
+
+
+CAPTCHA_STATS = CaptchaStats()
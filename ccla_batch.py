@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Location-aware CCLA batch scheduler
+
+Queued CCLA queries are grouped and ordered by district, division, mandal
+and village, and each worker keeps its page on the search form between
+queries. Only the dropdown levels that differ from the previous query are
+changed, so consecutive queries for the same village skip location
+selection entirely. The run reports how many dropdown changes were saved.
+
+Queries come from a CSV or JSON file with the fields:
+    district, division, mandal, village, mode, buyer, seller
+
+Usage: python ccla_batch.py queries.csv --workers 2 --headless
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import sys
+import time
+from datetime import datetime
+from itertools import groupby
+from pathlib import Path
+
+from playwright.async_api import async_playwright
+
+from ccla_search import LOCATION_LEVELS, run_ccla_search, search_failed, setup_page
+from concurrency import get_limiter
+from context_pool import DEFAULT_HEAP_BUDGET_MB, DEFAULT_MAX_SEARCHES, WorkerContext
+from export_sink import ExportSink
+from name_index import NameIndex
+
+
+def location_of(query: dict) -> tuple:
+    return tuple(str(query.get(level) or '') for level in LOCATION_LEVELS)
+
+
+def dropdown_changes(queries: list) -> int:
+    """Dropdowns a single page changes to run queries in this order"""
+    changes = 0
+    previous = None
+    for query in queries:
+        location = location_of(query)
+        if previous is None:
+            changes += len(LOCATION_LEVELS)
+        else:
+            # Everything from the first differing level down is re-selected
+            same = next((i for i, (a, b) in enumerate(zip(previous, location)) if a != b), len(location))
+            changes += len(location) - same
+        previous = location
+    return changes
+
+
+def schedule(queries: list, workers: int = 1) -> list:
+    """Queries sorted by location and split into one contiguous run per worker
+    
+    Runs are cut only between villages, so each village's queries stay on
+    one page, and neighbouring villages (same mandal) tend to stay together.
+    """
+    ordered = sorted(queries, key=location_of)
+    villages = [list(group) for _, group in groupby(ordered, key=location_of)]
+    target = len(ordered) / max(workers, 1)
+    
+    runs = [[]]
+    for village in villages:
+        if runs[-1] and len(runs[-1]) + len(village) / 2 > target and len(runs) < workers:
+            runs.append([])
+        runs[-1].extend(village)
+    return [run for run in runs if run]
+
+
+async def run_worker(worker: WorkerContext, queries: list, output_dir: str, sink: ExportSink,
+                     save_artifacts: bool, records, name_index: NameIndex = None) -> dict:
+    """Run a worker's queries in order on its page
+    
+    Returns the searches completed, the dropdowns they changed and the
+    searches that failed (not counted in the dropdown changes).
+    """
+    counts = {'completed': 0, 'changes': 0, 'failed': 0}
+    for query in queries:
+        async with get_limiter('ccla').slot() as outcome:
+            page = await worker.get_page()
+            try:
+                result = await run_ccla_search(
+                    page, query['district'], query['division'], query['mandal'], query['village'],
+                    query.get('mode') or 'buyerSeller', query.get('buyer') or None, query.get('seller') or None,
+                    output_dir, name_index=name_index, sink=sink, save_artifacts=save_artifacts, reuse_page=True
+                )
+                counts['completed'] += 1
+                counts['changes'] += result['locationChanges']
+                if search_failed(result):
+                    outcome['error'] = result.get('message')
+            except Exception as e:
+                outcome['error'] = str(e)
+                result = {'found': False, 'message': f'{type(e).__name__}: {e}'}
+                # The page may be anywhere now; the next query reloads the form if needed
+                counts['failed'] += 1
+            finally:
+                await worker.search_done()
+        records.write(json.dumps({'query': query, 'result': result}, ensure_ascii=False) + '\n')
+        records.flush()
+    return counts
+
+
+async def run_batch(
+    queries: list,
+    headless: bool = True,
+    output_dir: str = 'output',
+    workers: int = 1,
+    max_workers: int = None,
+    export: bool = False,
+    save_artifacts: bool = True,
+    memory_log: str = None,
+    index_path: str = None,
+    max_searches: int = DEFAULT_MAX_SEARCHES,
+    heap_budget_mb: float = DEFAULT_HEAP_BUDGET_MB
+) -> dict:
+    """Run CCLA queries in location order and report the dropdown changes saved
+    
+    Queries are split over max_workers pages (default twice workers); the
+    CCLA limiter starts with workers searching at once and raises that up to
+    max_workers while the portal stays fast.
+    
+    Worker contexts are recycled after max_searches or past heap_budget_mb
+    of JS heap. With index_path, owner names are added to that name_index.NameIndex as
+    results land.
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    records_path = f"{output_dir}/ccla_batch_{stamp}.jsonl"
+    memory_log = memory_log or f"{output_dir}/worker_memory_{stamp}.jsonl"
+    max_workers = max(max_workers or 2 * workers, workers)
+    runs = schedule(queries, max_workers)
+    # extract_results names files by the second, so each worker gets its own directory
+    worker_dirs = [f"{output_dir}/worker_{i}" for i in range(1, len(runs) + 1)]
+    for i, run in enumerate(runs, 1):
+        print(f"[BATCH] Worker {i}: {len(run)} queries, {len(set(map(location_of, run)))} villages")
+        if save_artifacts:
+            Path(worker_dirs[i - 1]).mkdir(parents=True, exist_ok=True)
+        
+    started = time.monotonic()
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=headless)
+        pool = [WorkerContext(browser, f'ccla-{i}', {'viewport': {'width': 1280, 'height': 900}},
+                              page_setup=setup_page, memory_log=memory_log,
+                              max_searches=max_searches, heap_budget_mb=heap_budget_mb)
+                for i in range(1, len(runs) + 1)]
+        get_limiter('ccla', initial=min(workers, len(runs)), maximum=len(runs))
+        sink = ExportSink(output_dir) if export else None
+        name_index = NameIndex(index_path) if index_path else None
+        try:
+            with open(records_path, 'w', encoding='utf-8') as records:
+                counts = await asyncio.gather(*[
+                    run_worker(worker, run, worker_dir, sink, save_artifacts, records, name_index)
+                    for worker, run, worker_dir in zip(pool, runs, worker_dirs)
+                ])
+        finally:
+            if sink:
+                sink.close()
+            if name_index:
+                name_index.close()
+            for worker in pool:
+                await worker.close()
+            await browser.close()
+            
+    completed = sum(count['completed'] for count in counts)
+    stats = {
+        'queries': len(queries),
+        'completed': completed,
+        'failed': sum(count['failed'] for count in counts),
+        'dropdownChanges': sum(count['changes'] for count in counts),
+        # Every completed search re-selecting all four levels on a fresh page
+        'withoutReuse': completed * len(LOCATION_LEVELS),
+        # The same page reuse, but in the order the queries were given (all queries, simulated)
+        'inputOrder': dropdown_changes(queries),
+    }
+    stats['saved'] = stats['withoutReuse'] - stats['dropdownChanges']
+    
+    print("\n" + "="*50)
+    print("CCLA Batch Complete")
+    print("="*50)
+    print(f"Queries: {stats['queries']} on {len(runs)} workers ({stats['failed']} failed), "
+          f"CCLA limit now {get_limiter('ccla').limit}")
+    print(f"Dropdown changes: {stats['dropdownChanges']} "
+          f"(without reuse: {stats['withoutReuse']}, in input order: {stats['inputOrder']})")
+    print(f"Dropdown changes saved: {stats['saved']}")
+    print(f"Wall time: {time.monotonic() - started:.1f}s")
+    print(f"Records: {records_path}")
+    print(f"Worker memory samples: {memory_log}")
+    print("="*50 + "\n")
+    return stats
+
+
+def load_queries(path: str) -> list:
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.lower().endswith('.json'):
+            return json.load(f)
+        return [dict(row) for row in csv.DictReader(f)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run CCLA queries grouped by location')
+    parser.add_argument('queries', help='CSV or JSON file of queries')
+    parser.add_argument('--workers', type=int, default=1, help='Pages searching in parallel to start with')
+    parser.add_argument('--max-workers', type=int,
+                        help='Most pages searching in parallel while the portal is fast (default: twice --workers)')
+    parser.add_argument('--headless', action='store_true', help='Run in headless mode')
+    parser.add_argument('--output', default='output', help='Output directory')
+    parser.add_argument('--export', action='store_true', help='Stream results to JSONL/Parquet export files')
+    parser.add_argument('--no-artifacts', action='store_true',
+                        help='Skip per-search screenshot/HTML/JSON files')
+    parser.add_argument('--index', help='Name index database to add owner names to (e.g. output/name_index.sqlite)')
+    parser.add_argument('--max-searches', type=int, default=DEFAULT_MAX_SEARCHES,
+                        help='Searches before a worker context is recycled (0: never)')
+    parser.add_argument('--heap-budget-mb', type=float, default=DEFAULT_HEAP_BUDGET_MB,
+                        help="Worker page JS heap in MB above which its context is recycled (0: no budget)")
+    parser.add_argument('--memory-log', help='JSONL file for worker memory samples '
+                        '(default: worker_memory_<time>.jsonl in the output directory)')
+    
+    args = parser.parse_args()
+    
+    queries = load_queries(args.queries)
+    missing = [i for i, query in enumerate(queries, 1) if not all(query.get(level) for level in LOCATION_LEVELS)]
+    if missing:
+        print(f"Error: queries {missing} need district, division, mandal and village")
+        sys.exit(1)
+        
+    asyncio.run(run_batch(
+        queries,
+        headless=args.headless,
+        output_dir=args.output,
+        workers=args.workers,
+        max_workers=args.max_workers,
+        export=args.export,
+        save_artifacts=not args.no_artifacts,
+        memory_log=args.memory_log,
+        index_path=args.index,
+        max_searches=args.max_searches,
+        heap_budget_mb=args.heap_budget_mb
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -16,6 +16,12 @@ from pathlib import Path
 
 from playwright.async_api import async_playwright, Page
 
+from replay import open_context, write_session_meta
+from response_capture import ResponseCapture, html_to_text, parse_options, parse_tables
+
+
+# URLs
+CCLA_URL = 'https://ccla.telangana.gov.in/landStatus.done'
 
 # Selectors
 SELECTORS = {
@@ -49,26 +55,89 @@ SELECTORS = {
     },
 }
 
+# Header text that identifies the results table
+RESULT_HEADERS = ['Khata', 'Survey', 'Reason for Amendment']
 
-async def select_location(page: Page, district: str, division: str, mandal: str, village: str):
-    """Select location from cascading dropdowns"""
-    print(f"[CCLA] Selecting location: {district} → {division} → {mandal} → {village}")
-    
-    await page.select_option(SELECTORS['location']['district'], district)
-    await page.wait_for_timeout(1500)
-    print("[CCLA] ✓ District selected")
+# Cascading dropdown levels in selection order
+LOCATION_LEVELS = ['district', 'division', 'mandal', 'village']
+
+# Reads the CAPTCHA answer the page keeps in the DOM
+CAPTCHA_VALUE_JS = f"""
+    () => {{
+        const hidden = document.querySelector('{SELECTORS['captcha']['hidden']}');
+        if (hidden && hidden.value) return hidden.value;
+        const text = document.querySelector('{SELECTORS['captcha']['text']}');
+        if (text) return text.textContent;
+        return null;
+    }}
+"""
+
+
+async def select_dropdown(page: Page, capture: ResponseCapture, level: str, value: str, timeout: int = 10000) -> list:
+    """Select one dropdown level and return the options its XHR loads for the next level"""
+    try:
+        payload = await capture.expect(
+            lambda: page.select_option(SELECTORS['location'][level], value),
+            # CAPTCHA refreshes may run alongside, so their requests are not dropdown data
+            lambda payload: payload['type'] in ('xhr', 'fetch') and 'captcha' not in payload['url'].lower(),
+            timeout=timeout
+        )
+    except asyncio.TimeoutError:
+        return []
+    return parse_options(payload['body'])
+
+
+async def current_location(page: Page) -> dict:
+    """Values currently selected in the location dropdowns"""
+    return await page.evaluate("""
+        selectors => Object.fromEntries(Object.entries(selectors).map(
+            ([level, selector]) => [level, (document.querySelector(selector) || {}).value || null]
+        ))
+    """, SELECTORS['location'])
+
+
+async def select_location(page: Page, district: str, division: str, mandal: str, village: str,
+                          capture: ResponseCapture = None) -> int:
+    """Select location from cascading dropdowns
     
-    await page.select_option(SELECTORS['location']['division'], division)
-    await page.wait_for_timeout(1500)
-    print("[CCLA] ✓ Division selected")
+    Levels the page already has selected are kept: selection starts at the
+    first level that differs, since every level below it cascades. Returns
+    the number of dropdowns changed.
+    """
+    print(f"[CCLA] Selecting location: {district} → {division} → {mandal} → {village}")
     
-    await page.select_option(SELECTORS['location']['mandal'], mandal)
-    await page.wait_for_timeout(1500)
-    print("[CCLA] ✓ Mandal selected")
+    values = {'district': district, 'division': division, 'mandal': mandal, 'village': village}
+    current = await current_location(page)
+    start = next((i for i, level in enumerate(LOCATION_LEVELS) if current.get(level) != str(values[level])),
+                 len(LOCATION_LEVELS))
+    if start == len(LOCATION_LEVELS):
+        print("[CCLA] ✓ Location already selected")
+        return 0
+    if start:
+        print(f"[CCLA] Keeping {', '.join(LOCATION_LEVELS[:start])}")
+        
+    own_capture = capture is None
+    if own_capture:
+        capture = ResponseCapture(page, resource_types=('xhr', 'fetch')).start()
     
-    await page.select_option(SELECTORS['location']['village'], village)
-    await page.wait_for_timeout(1000)
-    print("[CCLA] ✓ Village selected")
+    try:
+        for i, level in enumerate(LOCATION_LEVELS[start:], start):
+            next_level = LOCATION_LEVELS[i + 1] if i + 1 < len(LOCATION_LEVELS) else None
+            # The village XHR (if any) only feeds the search inputs, so don't wait long for it
+            options = await select_dropdown(page, capture, level, values[level],
+                                            timeout=10000 if next_level else 1000)
+            if next_level:
+                # The payload has arrived; make sure the next dropdown holds the wanted option
+                await page.wait_for_selector(
+                    f"{SELECTORS['location'][next_level]} option[value=\"{values[next_level]}\"]",
+                    state='attached', timeout=10000
+                )
+            loaded = f" ({len(options)} options loaded)" if options else ""
+            print(f"[CCLA] ✓ {level.capitalize()} selected{loaded}")
+    finally:
+        if own_capture:
+            capture.stop()
+    return len(LOCATION_LEVELS) - start
 
 
 async def select_search_type(page: Page, mode: str, buyer: str = None, seller: str = None):
@@ -98,11 +167,12 @@ async def select_search_type(page: Page, mode: str, buyer: str = None, seller: s
     elif mode == 'buyerSeller':
         await page.click(SELECTORS['searchType']['buyerSeller'])
         await page.wait_for_timeout(500)
+        # Both names are always set, so a reused page drops the previous query's
+        await page.fill(SELECTORS['inputs']['buyerName'], buyer or '')
+        await page.fill(SELECTORS['inputs']['sellerName'], seller or '')
         if buyer:
-            await page.fill(SELECTORS['inputs']['buyerName'], buyer)
             print(f"[CCLA] ✓ Buyer Name entered: {buyer}")
         if seller:
-            await page.fill(SELECTORS['inputs']['sellerName'], seller)
             print(f"[CCLA] ✓ Seller Name entered: {seller}")
     
     print("[CCLA] ✓ Search type selected")
@@ -116,29 +186,35 @@ async def solve_captcha(page: Page, max_retries: int = 3) -> bool:
         print(f"[CCLA] CAPTCHA attempt {attempt}/{max_retries}")
         
         # Refresh CAPTCHA
+        refreshed = False
         try:
+            previous = await page.evaluate(CAPTCHA_VALUE_JS)
             refresh_btn = page.locator(SELECTORS['captcha']['refresh']).first
             if await refresh_btn.is_visible(timeout=2000):
                 await refresh_btn.click()
+                refreshed = True
                 print("[CCLA] ✓ CAPTCHA refreshed")
             else:
-                await page.evaluate("window.refreshCaptcha?.()")
+                refreshed = await page.evaluate(
+                    "typeof window.refreshCaptcha === 'function' && (window.refreshCaptcha(), true)"
+                )
         except:
             pass
         
-        await page.wait_for_timeout(1500)
+        # Wait for the refreshed answer instead of a fixed delay
+        if refreshed:
+            try:
+                await page.wait_for_function(
+                    f"previous => {{ const value = ({CAPTCHA_VALUE_JS})(); "
+                    f"return value && value.trim().length > 1 && value !== previous; }}",
+                    arg=previous, timeout=5000
+                )
+            except Exception:
+                pass
         
         # Extract CAPTCHA from hidden field or text
         try:
-            solution = await page.evaluate(f"""
-                () => {{
-                    const hidden = document.querySelector('{SELECTORS['captcha']['hidden']}');
-                    if (hidden && hidden.value) return hidden.value;
-                    const text = document.querySelector('{SELECTORS['captcha']['text']}');
-                    if (text) return text.textContent;
-                    return null;
-                }}
-            """)
+            solution = await page.evaluate(CAPTCHA_VALUE_JS)
             
             if solution and len(solution.strip()) > 1:
                 solution = solution.strip()
@@ -152,45 +228,118 @@ async def solve_captcha(page: Page, max_retries: int = 3) -> bool:
                     return True
         except Exception as e:
             print(f"[CCLA] ⚠️ CAPTCHA attempt {attempt} failed: {e}")
-        
-        await page.wait_for_timeout(1000)
     
     print(f"[CCLA] ⚠️ CAPTCHA solving failed after {max_retries} attempts")
     return False
 
 
-async def submit_search(page: Page):
-    """Submit search form"""
+async def dismiss_dialog(dialog):
+    """Dismiss alerts raised by the search form"""
+    await dialog.dismiss()
+
+
+async def setup_page(page: Page):
+    """Register the dialog handler once, where a CCLA page is created"""
+    page.on("dialog", dismiss_dialog)
+
+
+async def submit_search(page: Page, capture: ResponseCapture = None) -> dict:
+    """Submit search form and return the results response payload, if captured"""
     print("[CCLA] Submitting search...")
     
-    # Handle potential dialog
-    page.on("dialog", lambda dialog: dialog.dismiss())
-    
-    await page.click(SELECTORS['buttons']['getDetails'])
-    await page.wait_for_timeout(3000)
+    if capture is None:
+        await page.click(SELECTORS['buttons']['getDetails'])
+        await page.wait_for_timeout(3000)
+        print("[CCLA] ✓ Search submitted")
+        return None
+        
+    # Resolve as soon as the results arrive instead of sleeping
+    payload = None
+    try:
+        payload = await capture.expect(
+            lambda: page.click(SELECTORS['buttons']['getDetails']),
+            lambda payload: payload['type'] == 'document' or payload['method'] == 'POST',
+            timeout=15000
+        )
+        await page.wait_for_load_state('domcontentloaded')
+    except asyncio.TimeoutError:
+        print("[CCLA] ⚠️ No results response captured, falling back to the rendered page")
     
     print("[CCLA] ✓ Search submitted")
+    return payload
+
+
+def search_failed(results: dict) -> bool:
+    """Whether a CCLA result is a failed search rather than an answer
+    
+    A page without a results table (other than 'No records found') is
+    usually a rejected CAPTCHA.
+    """
+    return not results.get('found') and results.get('message') != 'No records found'
+
 
+def find_results_table(html_content: str) -> dict:
+    """Results table in a results payload, identified by its headers"""
+    for table in parse_tables(html_content):
+        headers = ' '.join(table['headers'])
+        if any(marker in headers for marker in RESULT_HEADERS):
+            return table
+    return None
 
-async def extract_results(page: Page, output_dir: str) -> dict:
-    """Extract results and save files"""
+
+def row_to_record(cells: list) -> dict:
+    """Map a results table row to a record"""
+    return {
+        'khataNo': cells[0] if len(cells) > 0 else '',
+        'surveyNo': cells[1] if len(cells) > 1 else '',
+        'ownerName': cells[2] if len(cells) > 2 else '',
+        'extent': cells[3] if len(cells) > 3 else '',
+        'landType': cells[4] if len(cells) > 4 else '',
+        'reasonForAmendment': cells[5] if len(cells) > 5 else '',
+    }
+
+
+async def extract_results(page: Page, output_dir: str, response: dict = None, query: dict = None,
+                          save_artifacts: bool = True) -> dict:
+    """Extract results and save files
+    
+    When the results response was captured, rows are parsed straight from
+    its payload; otherwise they are read from the rendered page. query (the
+    location and search inputs) is stored with the results. With
+    save_artifacts off, no screenshot/HTML/JSON files are written.
+    """
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     base_path = f"{output_dir}/ccla_{timestamp}"
     
-    # Screenshot
-    screenshot_path = f"{base_path}.png"
-    await page.screenshot(path=screenshot_path, full_page=True)
-    print(f"[CCLA] 📸 Screenshot: {screenshot_path}")
+    screenshot_path = None
+    html_path = None
+    if save_artifacts:
+        # Screenshot
+        screenshot_path = f"{base_path}.png"
+        await page.screenshot(path=screenshot_path, full_page=True)
+        print(f"[CCLA] 📸 Screenshot: {screenshot_path}")
     
-    # HTML
-    html_content = await page.content()
-    html_path = f"{base_path}.html"
-    with open(html_path, 'w', encoding='utf-8') as f:
-        f.write(html_content)
-    print(f"[CCLA] 📄 HTML: {html_path}")
+        # HTML
+        if response and response['type'] == 'document':
+            html_content = response['body']
+        else:
+            html_content = await page.content()
+        html_path = f"{base_path}.html"
+        with open(html_path, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+        print(f"[CCLA] 📄 HTML: {html_path}")
     
     # Check for results
-    has_results = await page.locator('th:has-text("Khata"), th:has-text("Survey"), th:has-text("Reason for Amendment")').is_visible(timeout=5000)
+    table = find_results_table(response['body']) if response else None
+    if table:
+        has_results = True
+        rows = [row for row in table['rows'] if row]
+    else:
+        has_results = await page.locator('th:has-text("Khata"), th:has-text("Survey"), th:has-text("Reason for Amendment")').is_visible(timeout=5000)
+        rows = []
+        if has_results:
+            for row in await page.locator('table tbody tr').all():
+                rows.append(await row.locator('td').all_text_contents())
     
     results = {
         'portal': 'telangana-ccla',
@@ -198,6 +347,7 @@ async def extract_results(page: Page, output_dir: str) -> dict:
         'found': has_results,
         'screenshot': screenshot_path,
         'html': html_path,
+        'query': query,
         'data': []
     }
     
@@ -205,20 +355,14 @@ async def extract_results(page: Page, output_dir: str) -> dict:
         print("[CCLA] ✓ Results found")
         
         # Extract table data
-        rows = await page.locator('table tbody tr').all()
-        for row in rows:
-            cells = await row.locator('td').all_text_contents()
+        for cells in rows:
             if cells:
-                results['data'].append({
-                    'khataNo': cells[0] if len(cells) > 0 else '',
-                    'surveyNo': cells[1] if len(cells) > 1 else '',
-                    'ownerName': cells[2] if len(cells) > 2 else '',
-                    'extent': cells[3] if len(cells) > 3 else '',
-                    'landType': cells[4] if len(cells) > 4 else '',
-                    'reasonForAmendment': cells[5] if len(cells) > 5 else '',
-                })
+                results['data'].append(row_to_record(cells))
     else:
-        page_text = await page.evaluate("() => document.body.innerText")
+        if response:
+            page_text = html_to_text(response['body'])
+        else:
+            page_text = await page.evaluate("() => document.body.innerText")
         if 'no record' in page_text.lower():
             results['message'] = 'No records found'
             print("[CCLA] ℹ️ No records found")
@@ -227,14 +371,95 @@ async def extract_results(page: Page, output_dir: str) -> dict:
             print("[CCLA] ℹ️ No results table found")
     
     # Save JSON
-    json_path = f"{base_path}.json"
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
-    print(f"[CCLA] 📋 JSON: {json_path}")
+    if save_artifacts:
+        json_path = f"{base_path}.json"
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"[CCLA] 📋 JSON: {json_path}")
     
     return results
 
 
+async def run_ccla_search(
+    page: Page,
+    district: str,
+    division: str,
+    mandal: str,
+    village: str,
+    mode: str = 'buyerSeller',
+    buyer: str = None,
+    seller: str = None,
+    output_dir: str = 'output',
+    name_index=None,
+    sink=None,
+    save_artifacts: bool = True,
+    reuse_page: bool = False
+) -> dict:
+    """Run one CCLA search on an existing page
+    
+    Owner names in the results are added to name_index (a name_index.NameIndex)
+    and result rows to sink (an export_sink.ExportSink) when given.
+    
+    With reuse_page, a page still showing the search form is not reloaded,
+    so location dropdowns left by the previous search are kept where they
+    match (see ccla_batch.py). results['locationChanges'] counts the
+    dropdowns that had to be changed.
+    """
+    if reuse_page and await page.query_selector(SELECTORS['location']['district']):
+        print("[CCLA] Reusing the search form already loaded")
+    else:
+        # Navigate to portal
+        print("[CCLA] Navigating to portal...")
+        await page.goto(CCLA_URL, wait_until='domcontentloaded', timeout=60000)
+        await page.wait_for_selector(SELECTORS['location']['district'], state='attached', timeout=30000)
+        print(f"[CCLA] Current URL: {page.url}")
+        print("[CCLA] ✓ Portal initialized\n")
+    
+    # Capture dropdown and search responses as they arrive
+    capture = ResponseCapture(page).start()
+    
+    try:
+        # Solve CAPTCHA from the DOM while the location dropdowns load
+        captcha_task = asyncio.ensure_future(solve_captcha(page, 3))
+        try:
+            # Select location
+            location_changes = await select_location(page, district, division, mandal, village, capture)
+        
+            # Select search type
+            await select_search_type(page, mode, buyer, seller)
+        
+            captcha_solved = await captcha_task
+        finally:
+            if not captcha_task.done():
+                captcha_task.cancel()
+            await asyncio.gather(captcha_task, return_exceptions=True)
+        if not captcha_solved:
+            print("[CCLA] ⚠️ CAPTCHA may not be solved correctly")
+            
+        # Submit search
+        response = await submit_search(page, capture)
+        
+        # Extract results
+        query = {
+            'district': district,
+            'division': division,
+            'mandal': mandal,
+            'village': village,
+            'mode': mode,
+            'buyer': buyer,
+            'seller': seller,
+        }
+        results = await extract_results(page, output_dir, response, query, save_artifacts)
+        results['locationChanges'] = location_changes
+        if name_index is not None:
+            name_index.add_result(results, source=results['html'])
+        if sink is not None:
+            sink.add_ccla(results)
+        return results
+    finally:
+        capture.stop()
+
+
 async def search_ccla(
     district: str,
     division: str,
@@ -244,9 +469,16 @@ async def search_ccla(
     buyer: str = None,
     seller: str = None,
     headless: bool = False,
-    output_dir: str = 'output'
+    output_dir: str = 'output',
+    record_har: str = None,
+    replay_har: str = None,
+    replay_speed: float = 1.0
 ):
-    """Main CCLA search function"""
+    """Main CCLA search function
+    
+    record_har saves the session's network traffic for replay.py; replay_har
+    serves it back offline.
+    """
     print("\n" + "="*50)
     print("Telangana CCLA Portal Automation")
     print("="*50)
@@ -262,35 +494,22 @@ async def search_ccla(
     # Create output directory
     Path(output_dir).mkdir(exist_ok=True)
     
+    if record_har:
+        write_session_meta(record_har, 'ccla', {
+            'district': district, 'division': division, 'mandal': mandal, 'village': village,
+            'mode': mode, 'buyer': buyer, 'seller': seller
+        })
+        
     async with async_playwright() as p:
         browser = await p.chromium.launch(headless=headless, slow_mo=50 if not headless else 0)
-        context = await browser.new_context(viewport={'width': 1280, 'height': 900})
+        context = await open_context(browser, {'viewport': {'width': 1280, 'height': 900}},
+                                     record_har, replay_har, replay_speed)
         page = await context.new_page()
+        await setup_page(page)
         
         try:
-            # Navigate to portal
-            print("[CCLA] Navigating to portal...")
-            await page.goto('https://ccla.telangana.gov.in/landStatus.done', wait_until='domcontentloaded', timeout=60000)
-            await page.wait_for_timeout(2000)
-            print(f"[CCLA] Current URL: {page.url}")
-            print("[CCLA] ✓ Portal initialized\n")
-            
-            # Select location
-            await select_location(page, district, division, mandal, village)
-            
-            # Select search type
-            await select_search_type(page, mode, buyer, seller)
-            
-            # Solve CAPTCHA
-            captcha_solved = await solve_captcha(page, 3)
-            if not captcha_solved:
-                print("[CCLA] ⚠️ CAPTCHA may not be solved correctly")
-            
-            # Submit search
-            await submit_search(page)
-            
-            # Extract results
-            results = await extract_results(page, output_dir)
+            results = await run_ccla_search(page, district, division, mandal, village,
+                                            mode, buyer, seller, output_dir)
             
             print("\n" + "="*50)
             print("Search Complete")
@@ -301,7 +520,7 @@ async def search_ccla(
             print("="*50 + "\n")
             
             # Keep browser open for inspection if headed
-            if not headless:
+            if not headless and not replay_har:
                 print("[CCLA] Browser open for 30 seconds for inspection...")
                 await page.wait_for_timeout(30000)
             
@@ -314,6 +533,8 @@ async def search_ccla(
             print(f"[CCLA] 📸 Error screenshot: {error_screenshot}")
             raise
         finally:
+            # Closing the context writes the recorded HAR
+            await context.close()
             await browser.close()
 
 
@@ -329,6 +550,7 @@ def main():
     parser.add_argument('--seller', help='Seller name (for buyerSeller mode)')
     parser.add_argument('--headless', action='store_true', help='Run in headless mode')
     parser.add_argument('--output', default='output', help='Output directory')
+    parser.add_argument('--record', metavar='HAR', help='Record the session for offline replay (replay.py)')
     
     args = parser.parse_args()
     
@@ -347,7 +569,8 @@ def main():
         buyer=args.buyer,
         seller=args.seller,
         headless=args.headless,
-        output_dir=args.output
+        output_dir=args.output,
+        record_har=args.record
     ))
 
 
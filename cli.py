@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Single entry point for the portal tools
+
+Each subcommand hands its arguments to the matching script's main(), and
+only that script (with its dependencies) is imported, so `cli.py --help`
+and CCLA runs never load the Gemini SDK.
+
+Usage:
+    python cli.py ccla --district 31 --division 67 --mandal 609 --village 3111005 --buyer "Kumar"
+    python cli.py ec --doc 1234 --year 2024 --sro "HYDERABAD"
+    python cli.py batch parcels.csv --headless
+    python cli.py serve --port 8080
+    python cli.py --startup-time ccla --help
+"""
+
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import importlib
+import os
+import sys
+
+
+# Subcommand -> (module with a main(), help)
+COMMANDS = {
+    'ccla': ('ccla_search', 'CCLA land status search'),
+    'ec': ('registration_search', 'Registration EC search'),
+    'ec-http': ('ec_http', 'EC searches over HTTP after a browser login'),
+    'batch': ('pipeline', 'CCLA + EC searches for a file of parcels'),
+    'ccla-batch': ('ccla_batch', 'CCLA searches grouped by location'),
+    'serve': ('server', 'HTTP search service'),
+    'replay': ('replay', 'Replay a recorded session offline'),
+    'index': ('name_index', 'Local owner name index'),
+}
+
+
+def process_age_ms() -> float:
+    """Milliseconds since this process started, interpreter start-up included (Linux only)"""
+    try:
+        with open('/proc/self/stat') as f:
+            # Field 22 (starttime) in clock ticks since boot; skip the parenthesised command name
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    return (uptime - start_ticks / os.sysconf('SC_CLK_TCK')) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Telangana portal automation')
+    parser.add_argument('--startup-time', action='store_true',
+                        help='Print how long start-up took before the subcommand runs')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, (module, description) in COMMANDS.items():
+        # Subcommand options (including --help) are left for the script itself to parse
+        subparsers.add_parser(name, help=description, add_help=False)
+        
+    args, script_args = parser.parse_known_args()
+    
+    module_name = COMMANDS[args.command][0]
+    module = importlib.import_module(module_name)
+    
+    if args.startup_time:
+        age = process_age_ms()
+        process = f", {age:.0f} ms since process start" if age is not None else ''
+        print(f"[CLI] Startup: {(time.perf_counter() - STARTED) * 1000:.0f} ms to load {module_name}{process}",
+              file=sys.stderr)
+              
+    sys.argv = [f'cli.py {args.command}'] + script_args
+    module.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Adaptive concurrency control for portal searches
+
+Each portal gets a PortalLimiter that adjusts how many searches may be in
+flight (AIMD: additive increase while the portal is fast and healthy,
+multiplicative decrease on slow responses and overload signals) and opens a
+circuit breaker during outages so queued searches pause instead of burning
+60 s timeouts and retries.
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+# Failure signals seen in exceptions, page text and result messages
+SIGNALS = {
+    'timeout': ['timeout', 'timed out'],
+    'unavailable': ['err_connection', 'err_name_not_resolved', 'net::', 'service unavailable',
+                    'bad gateway', 'gateway timeout'],
+    'unauthorised': ['unauthorised access', 'unauthorized', 'request denied', 'session expired'],
+    'captcha': ['invalid captcha', 'captcha solving failed'],
+}
+
+# Signals that mean the portal itself is struggling
+OVERLOAD_SIGNALS = ('timeout', 'unavailable', 'unauthorised')
+
+
+def classify_failure(text: str) -> str:
+    """Map an error or page message to a failure signal, or None"""
+    lowered = (text or '').lower()
+    for signal, markers in SIGNALS.items():
+        if any(marker in lowered for marker in markers):
+            return signal
+    return None
+
+
+class PortalLimiter:
+    """AIMD limit on in-flight searches for one portal, with a circuit breaker"""
+    
+    def __init__(
+        self,
+        portal: str,
+        initial: int = 2,
+        minimum: int = 1,
+        maximum: int = 8,
+        target_latency: float = 45.0,
+        decrease_factor: float = 0.5,
+        failure_threshold: int = 3,
+        cooldown: float = 60.0,
+        max_cooldown: float = 600.0,
+        history: int = 50
+    ):
+        self.portal = portal
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        
+        self.window = float(initial)
+        self.in_flight = 0
+        self.state = 'closed'
+        self.open_until = 0.0
+        self.consecutive_failures = 0
+        self.probing = False
+        self.outcomes = deque(maxlen=history)
+        self._cond_obj = None
+    
+    @property
+    def _cond(self) -> asyncio.Condition:
+        # Created on first use so the limiter binds to the running event loop
+        if self._cond_obj is None:
+            self._cond_obj = asyncio.Condition()
+        return self._cond_obj
+    
+    @property
+    def limit(self) -> int:
+        return max(self.minimum, min(self.maximum, int(self.window)))
+    
+    async def acquire(self):
+        """Wait for a free slot, honouring the limit and the circuit breaker"""
+        async with self._cond:
+            while True:
+                if self.state == 'open':
+                    remaining = self.open_until - time.monotonic()
+                    if remaining > 0:
+                        try:
+                            await asyncio.wait_for(self._cond.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                    print(f"[LIMIT] {self.portal}: circuit half-open, sending a probe")
+                    self.state = 'half_open'
+                    self.probing = False
+                    
+                if self.state == 'half_open':
+                    # Only one probe search while the portal is on trial
+                    if not self.probing:
+                        self.probing = True
+                        self.in_flight += 1
+                        return
+                elif self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                    
+                await self._cond.wait()
+    
+    async def release(self, latency: float, signal: str = None):
+        """Return a slot and adapt the limit from the observed outcome
+        
+        signal 'cancelled' frees the slot without counting an outcome; a
+        cancelled probe lets the next search probe instead.
+        """
+        async with self._cond:
+            self.in_flight -= 1
+            
+            if signal == 'cancelled':
+                if self.state == 'half_open':
+                    self.probing = False
+            else:
+                self.outcomes.append((latency, signal))
+                if signal in OVERLOAD_SIGNALS:
+                    self._on_overload(signal)
+                elif signal is None:
+                    self._on_success(latency)
+                elif self.state == 'half_open':
+                    # The portal answered; a CAPTCHA or search-level failure is not an outage
+                    self._close(f'probe answered ({signal})')
+                
+            self._cond.notify_all()
+    
+    def _on_success(self, latency: float):
+        self.consecutive_failures = 0
+        if self.state == 'half_open':
+            self._close('probe succeeded')
+            return
+            
+        if latency > self.target_latency:
+            self.window = max(self.minimum, self.window * self.decrease_factor)
+        else:
+            # Additive increase: roughly +1 per window's worth of successes
+            self.window = min(self.maximum, self.window + 1.0 / self.limit)
+    
+    def _on_overload(self, signal: str):
+        self.consecutive_failures += 1
+        self.window = max(self.minimum, self.window * self.decrease_factor)
+        
+        if self.state == 'open':
+            return
+        if self.state == 'half_open':
+            self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+            self._open(signal)
+        elif self.consecutive_failures >= self.failure_threshold:
+            self._open(signal)
+    
+    def _close(self, reason: str):
+        print(f"[LIMIT] {self.portal}: {reason}, circuit closed")
+        self.state = 'closed'
+        self.probing = False
+        self.consecutive_failures = 0
+        self.cooldown = self.base_cooldown
+        self.window = float(self.minimum)
+    
+    def _open(self, signal: str):
+        self.state = 'open'
+        self.probing = False
+        self.open_until = time.monotonic() + self.cooldown
+        print(f"[LIMIT] {self.portal}: circuit open for {self.cooldown:.0f}s after {signal}")
+    
+    @asynccontextmanager
+    async def slot(self):
+        """Hold a slot for one search
+        
+        Yields a dict; set its 'error' to the result message of a search that
+        failed without raising so the failure still counts.
+        """
+        await self.acquire()
+        outcome = {'error': None}
+        started = time.monotonic()
+        # Anything that escapes the block without being classified (cancellation) frees the slot only
+        signal = 'cancelled'
+        try:
+            yield outcome
+            signal = None
+            if outcome['error']:
+                signal = classify_failure(outcome['error']) or 'error'
+        except Exception as e:
+            signal = classify_failure(str(e)) or 'error'
+            raise
+        finally:
+            await self.release(time.monotonic() - started, signal)
+    
+    def stats(self) -> dict:
+        """Current limit, breaker state and recent latency / error rate"""
+        latencies = [latency for latency, signal in self.outcomes if signal is None]
+        errors = [signal for _, signal in self.outcomes if signal is not None]
+        return {
+            'portal': self.portal,
+            'limit': self.limit,
+            'inFlight': self.in_flight,
+            'state': self.state,
+            'avgLatency': round(sum(latencies) / len(latencies), 2) if latencies else None,
+            'errorRate': round(len(errors) / len(self.outcomes), 3) if self.outcomes else 0.0,
+            'signals': {signal: errors.count(signal) for signal in set(errors)},
+        }
+
+
+# One limiter per portal, shared by everything running in this process
+LIMITERS = {}
+
+
+def get_limiter(portal: str, **kwargs) -> PortalLimiter:
+    """Shared limiter for a portal ('ccla' or 'registration')"""
+    if portal not in LIMITERS:
+        LIMITERS[portal] = PortalLimiter(portal, **kwargs)
+    return LIMITERS[portal]
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Browser context lifecycle for long-running batch workers
+
+Each worker owns a WorkerContext that hands out its page, counts searches
+and samples its page's memory (Chromium performance metrics over CDP) after
+each one. After a set number of searches, or when the worker's JS heap
+crosses a budget, the page and context are closed and replaced; cookies and
+local storage are carried over so a logged-in Registration session survives
+the recycle.
+"""
+
+import json
+import os
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+
+# Default context recycling limits
+DEFAULT_MAX_SEARCHES = 25
+DEFAULT_HEAP_BUDGET_MB = 300
+
+
+def _proc_rss_mb(pid: int) -> float:
+    """Resident memory of one process from /proc, in MB"""
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return 0.0
+
+
+def process_tree_rss_mb(root_pid: int = None) -> float:
+    """Resident memory of this process and all its descendants (Chromium included), in MB
+    
+    Returns None where /proc is not available.
+    """
+    if not os.path.isdir('/proc'):
+        return None
+    root_pid = root_pid or os.getpid()
+    
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                # The command name can contain spaces, so split after its closing paren
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+        
+    total = 0.0
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        total += _proc_rss_mb(pid)
+        stack.extend(children.get(pid, []))
+    return round(total, 1)
+
+
+class WorkerContext:
+    """A worker's browser context and page, recycled by search count or memory budget"""
+    
+    def __init__(
+        self,
+        browser,
+        worker_id,
+        context_options: dict = None,
+        max_searches: int = DEFAULT_MAX_SEARCHES,
+        heap_budget_mb: float = DEFAULT_HEAP_BUDGET_MB,
+        preserve_session: bool = True,
+        page_setup=None,
+        memory_log: str = None
+    ):
+        self.browser = browser
+        self.worker_id = worker_id
+        self.context_options = context_options or {}
+        self.max_searches = max_searches
+        self.heap_budget_mb = heap_budget_mb
+        self.preserve_session = preserve_session
+        self.page_setup = page_setup
+        self.memory_log = memory_log
+        
+        self.context = None
+        self.page = None
+        self.cdp = None
+        self.searches = 0
+        self.total_searches = 0
+        self.recycles = 0
+        # Recent samples only; the full history goes to memory_log
+        self.samples = deque(maxlen=500)
+    
+    async def get_page(self):
+        """Current page, opening a context first if needed"""
+        if self.page is None or self.page.is_closed():
+            await self._open()
+        return self.page
+    
+    async def _open(self, storage_state: dict = None):
+        options = dict(self.context_options)
+        if storage_state:
+            options['storage_state'] = storage_state
+        self.context = await self.browser.new_context(**options)
+        self.page = await self.context.new_page()
+        try:
+            self.cdp = await self.context.new_cdp_session(self.page)
+            await self.cdp.send('Performance.enable')
+        except Exception:
+            # Not Chromium: fall back to performance.memory
+            self.cdp = None
+        if self.page_setup:
+            await self.page_setup(self.page)
+        self.searches = 0
+    
+    async def close(self):
+        """Close the page and context; their event listeners go with them"""
+        if self.context is not None:
+            await self.context.close()
+        self.context = None
+        self.page = None
+        self.cdp = None
+    
+    async def recycle(self, reason: str):
+        """Replace the context, carrying over cookies and storage if configured"""
+        storage_state = None
+        if self.preserve_session and self.context is not None:
+            try:
+                storage_state = await self.context.storage_state()
+            except Exception as e:
+                print(f"[CTX] worker {self.worker_id}: could not save session state: {e}")
+                
+        await self.close()
+        await self._open(storage_state)
+        self.recycles += 1
+        print(f"[CTX] worker {self.worker_id}: context recycled ({reason})")
+    
+    async def page_metrics(self) -> dict:
+        """This worker's page memory: JS heap in MB plus DOM node and document counts"""
+        if self.page is None or self.page.is_closed():
+            return {}
+        try:
+            if self.cdp is not None:
+                metrics = {m['name']: m['value'] for m in (await self.cdp.send('Performance.getMetrics'))['metrics']}
+                return {
+                    'jsHeapMb': round(metrics.get('JSHeapTotalSize', 0) / (1024 * 1024), 1),
+                    'jsHeapUsedMb': round(metrics.get('JSHeapUsedSize', 0) / (1024 * 1024), 1),
+                    'nodes': int(metrics.get('Nodes', 0)),
+                    'documents': int(metrics.get('Documents', 0)),
+                }
+            heap = await self.page.evaluate("() => performance.memory ? performance.memory.totalJSHeapSize : null")
+            return {'jsHeapMb': round(heap / (1024 * 1024), 1) if heap else None}
+        except Exception:
+            return {}
+    
+    async def sample_memory(self) -> dict:
+        """Record this worker's page memory, with the whole run's RSS for reference"""
+        sample = {
+            'worker': self.worker_id,
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'searches': self.total_searches,
+            'recycles': self.recycles,
+            'jsHeapMb': None,
+        }
+        sample.update(await self.page_metrics())
+        # Shared by every worker (all browsers of this process), so never compared to the budget
+        sample['totalRssMb'] = process_tree_rss_mb()
+        self.samples.append(sample)
+        if self.memory_log:
+            Path(self.memory_log).parent.mkdir(parents=True, exist_ok=True)
+            with open(self.memory_log, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(sample) + '\n')
+        print(f"[CTX] worker {self.worker_id}: {self.total_searches} searches, "
+              f"JS heap {sample['jsHeapMb']} MB, {sample.get('nodes')} DOM nodes "
+              f"(process total RSS {sample['totalRssMb']} MB)")
+        return sample
+    
+    async def search_done(self):
+        """Count a finished search and recycle the context if a limit is reached"""
+        self.searches += 1
+        self.total_searches += 1
+        sample = await self.sample_memory()
+        
+        if self.max_searches and self.searches >= self.max_searches:
+            await self.recycle(f'{self.searches} searches')
+        elif self.heap_budget_mb and sample['jsHeapMb'] and sample['jsHeapMb'] > self.heap_budget_mb:
+            await self.recycle(f"JS heap {sample['jsHeapMb']} MB over {self.heap_budget_mb} MB budget")
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Hybrid EC search engine
+
+The browser is only used for the interactive login. Each login's cookies are
+exported from its BrowserContext into a Playwright API request context (a
+pooled HTTP client, no rendering), and the EC search steps run over plain
+HTTP: the forms, NEXT links and chkDocId checkboxes are parsed from the
+HTML and submitted the way the browser would. The report is saved with
+capture_ec_report, so results match the browser flow (without screenshots).
+
+Every pooled session runs one search at a time, since the portal keeps the
+EC flow in the server-side session; one browser can feed several sessions.
+
+Usage:
+    python ec_http.py --doc 1234 --year 2024 --sro "HYDERABAD"
+    python ec_http.py --batch documents.csv --sessions 3 --headless
+"""
+
+import argparse
+import asyncio
+import csv
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlencode, urljoin
+
+from playwright.async_api import async_playwright
+
+from registration_search import (
+    DEFAULT_PASSWORD, DEFAULT_USERNAME, EC_SEARCH_URL, EC_STATEMENT_URL, SELECTORS, capture_ec_report, login
+)
+from response_capture import (
+    form_pairs, html_to_text, parse_forms, parse_html, parse_input_values, parse_links
+)
+
+
+class SessionExpired(Exception):
+    """The portal no longer accepts the session's cookies"""
+
+
+def field_name(form: dict, selector: str) -> str:
+    """Name of the form field an '#id' selector points at"""
+    element_id = selector.lstrip('#')
+    for field in form['fields']:
+        if field.get('id') == element_id and field.get('name'):
+            return field['name']
+    return element_id
+
+
+def is_submit(field: dict) -> bool:
+    kind = (field.get('type') or ('submit' if field.get('tag') == 'button' else '')).lower()
+    return kind in ('submit', 'image')
+
+
+def label(field: dict) -> str:
+    return (field.get('text') or field.get('value') or '').upper()
+
+
+def html_ec_state(body: str) -> str:
+    """Which page of the EC flow an HTML response is (detect_ec_state for HTML)"""
+    parsed = parse_html(body)
+    text = html_to_text(body)
+    lowered = text.lower()
+    fields = [field for form in parsed.forms for field in form['fields']]
+    
+    if 'Unauthorised Access' in text or 'Request denied' in text:
+        return 'unauthorised'
+    if 'Request Number' in text or 'Application Number' in text:
+        return 'report'
+    if 'no record' in lowered or 'not found' in lowered:
+        return 'no_records'
+    if any(attrs.get('name') == 'chkDocId' for attrs in parsed.inputs):
+        return 'documents'
+    if any('NEXT' in label(field) for field in parsed.links + fields):
+        return 'results'
+    if any(field.get('name') == 'docSel' for field in fields):
+        return 'search_form'
+    if any(is_submit(field) for field in fields):
+        return 'date_range'
+    return 'unknown'
+
+
+async def fetch(request, method: str, url: str, pairs: list = None) -> tuple:
+    """Body and final URL of a GET or form POST"""
+    if method == 'POST':
+        response = await request.post(url, data=urlencode(pairs or []),
+                                      headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    else:
+        query = urlencode(pairs or [])
+        response = await request.get(f"{url}{'&' if '?' in url else '?'}{query}" if query else url)
+    body = await response.text()
+    if html_ec_state(body) == 'unauthorised':
+        raise SessionExpired(f'Unauthorised Access at {response.url}')
+    return body, response.url
+
+
+async def submit_form(request, form: dict, base_url: str, overrides: dict = None, submitter: dict = None) -> tuple:
+    action = urljoin(base_url, form['action']) if form['action'] else base_url
+    return await fetch(request, form['method'], action, form_pairs(form, overrides, submitter))
+
+
+def form_with(forms: list, predicate) -> tuple:
+    """First form with a field matching predicate, and that field"""
+    for form in forms:
+        for field in form['fields']:
+            if predicate(field):
+                return form, field
+    return None, None
+
+
+async def open_search_form(request) -> tuple:
+    """EC Statement page, then its Submit link to the search form (as navigate_to_ec_search)"""
+    body, url = await fetch(request, 'GET', EC_STATEMENT_URL)
+    if html_ec_state(body) != 'search_form':
+        link = next((link for link in parse_links(body)
+                     if 'Search_Document' in (link.get('href') or '')), None)
+        body, url = await fetch(request, 'GET', urljoin(url, link['href']) if link else EC_SEARCH_URL)
+    return body, url
+
+
+async def http_step_fill_form(request, body: str, url: str, flow: dict) -> tuple:
+    """Step 1: submit the document search form"""
+    form, _ = form_with(parse_forms(body), lambda field: field.get('name') == 'docSel')
+    fields = SELECTORS['documentSearch']
+    overrides = {
+        'docSel': '1',
+        field_name(form, fields['documentNo']): flow['doc_no'],
+        field_name(form, fields['yearOfRegistration']): flow['year'],
+        field_name(form, fields['sroAutocomplete']): flow['sro'],
+    }
+    return await submit_form(request, form, url, overrides, form_with([form], is_submit)[1])
+
+
+async def http_step_next(request, body: str, url: str, flow: dict) -> tuple:
+    """Step 2: follow NEXT on the search results"""
+    parsed = parse_html(body)
+    for link in parsed.links:
+        href = link.get('href') or ''
+        if 'NEXT' in label(link) and href and not href.lower().startswith('javascript'):
+            return await fetch(request, 'GET', urljoin(url, href))
+    form, button = form_with(parsed.forms, lambda field: is_submit(field) and 'NEXT' in label(field))
+    if form is None:
+        raise Exception('NEXT is script-driven on this page; it cannot be followed over HTTP')
+    return await submit_form(request, form, url, submitter=button)
+
+
+async def http_step_dates(request, body: str, url: str, flow: dict) -> tuple:
+    """Step 3: submit the date range with its defaults"""
+    form, button = form_with(parse_forms(body), is_submit)
+    return await submit_form(request, form, url, submitter=button)
+
+
+async def http_step_documents(request, body: str, url: str, flow: dict) -> tuple:
+    """Steps 4 and 5: submit every document for the final EC Report"""
+    flow['documents'] = parse_input_values(body, 'chkDocId')
+    print(f"[EC-HTTP] Documents found: {len(flow['documents'])}")
+    form, _ = form_with(parse_forms(body), lambda field: field.get('name') == 'chkDocId')
+    return await submit_form(request, form, url, {'chkDocId': flow['documents']}, form_with([form], is_submit)[1])
+
+
+# Step to run for each page state
+HTTP_EC_STEPS = {
+    'search_form': http_step_fill_form,
+    'results': http_step_next,
+    'date_range': http_step_dates,
+    'documents': http_step_documents,
+}
+
+
+async def http_ec_search(
+    request,
+    doc_no: str,
+    year: str,
+    sro: str,
+    output_dir: str = 'output',
+    pdf_pool=None,
+    save_artifacts: bool = True,
+    max_steps: int = 8
+) -> dict:
+    """EC document search over a logged-in API request context
+    
+    Returns the same dict as search_by_document_number; raises SessionExpired
+    when the session has to be renewed.
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    query = {'doc_no': doc_no, 'year': year, 'sro': sro}
+    flow = dict(query, documents=[])
+    body, url = '', EC_STATEMENT_URL
+    
+    try:
+        body, url = await open_search_form(request)
+        for _ in range(max_steps):
+            state = html_ec_state(body)
+            print(f"[EC-HTTP] {doc_no}/{year}: {state}")
+            if state == 'report':
+                return await capture_ec_report(None, output_dir, timestamp, flow['documents'], pdf_pool,
+                                               body, query, save_artifacts, url=url)
+            if state == 'no_records':
+                return {
+                    'success': False,
+                    'message': 'No records found for this document',
+                    'timestamp': timestamp
+                }
+            if state not in HTTP_EC_STEPS:
+                raise Exception(f'Unrecognised page at {url}')
+            body, url = await HTTP_EC_STEPS[state](request, body, url, flow)
+        raise Exception(f'No report after {max_steps} steps')
+        
+    except SessionExpired:
+        raise
+    except Exception as e:
+        print(f"[EC-HTTP] Search error: {e}")
+        error_html = None
+        if save_artifacts:
+            error_html = f"{output_dir}/ts_reg_error_{timestamp}.html"
+            with open(error_html, 'w', encoding='utf-8') as f:
+                f.write(body)
+        return {
+            'success': False,
+            'message': f'Search failed: {str(e)}',
+            'html': error_html,
+            'timestamp': timestamp
+        }
+
+
+class EcHttpPool:
+    """Logged-in HTTP sessions created by one browser, one search each at a time"""
+    
+    def __init__(self, playwright, browser, sessions: int = 2,
+                 username: str = DEFAULT_USERNAME, password: str = DEFAULT_PASSWORD):
+        self.playwright = playwright
+        self.browser = browser
+        self.sessions = sessions
+        self.username = username
+        self.password = password
+        self.logins = 0
+        self._idle = asyncio.Queue()
+        self._login_lock = None
+    
+    async def start(self):
+        self._login_lock = asyncio.Lock()
+        for _ in range(self.sessions):
+            self._idle.put_nowait(await self._new_session())
+        return self
+    
+    async def _new_session(self):
+        """Log in on a throwaway browser context and move its cookies to an HTTP client"""
+        async with self._login_lock:
+            context = await self.browser.new_context(viewport={'width': 1400, 'height': 900})
+            try:
+                page = await context.new_page()
+                if not await login(page, context, self.username, self.password):
+                    raise Exception('Login failed')
+                user_agent = await page.evaluate("() => navigator.userAgent")
+                state = await context.storage_state()
+            finally:
+                await context.close()
+        self.logins += 1
+        print(f"[EC-HTTP] 🔑 Session ready ({len(state['cookies'])} cookies)")
+        return await self.playwright.request.new_context(storage_state=state, user_agent=user_agent)
+    
+    async def search(self, doc_no: str, year: str, sro: str, output_dir: str = 'output',
+                     pdf_pool=None, sink=None, save_artifacts: bool = True) -> dict:
+        """Run one EC search on a free session, logging in again once if it expired"""
+        request = await self._idle.get()
+        try:
+            if request is None:
+                request = await self._new_session()
+            try:
+                result = await http_ec_search(request, doc_no, year, sro, output_dir, pdf_pool, save_artifacts)
+            except SessionExpired as e:
+                print(f"[EC-HTTP] {e}, logging in again...")
+                await request.dispose()
+                request = None
+                request = await self._new_session()
+                result = await http_ec_search(request, doc_no, year, sro, output_dir, pdf_pool, save_artifacts)
+        finally:
+            # A session that could not be renewed is replaced on next use
+            self._idle.put_nowait(request)
+            
+        if sink is not None and result['success']:
+            sink.add_ec(result)
+        return result
+    
+    async def close(self):
+        while not self._idle.empty():
+            request = self._idle.get_nowait()
+            if request is not None:
+                await request.dispose()
+
+
+async def run_http_searches(
+    searches: list,
+    username: str = DEFAULT_USERNAME,
+    password: str = DEFAULT_PASSWORD,
+    headless: bool = True,
+    output_dir: str = 'output',
+    sessions: int = 2
+) -> list:
+    """Run EC searches ({'doc', 'year', 'sro'}) concurrently over pooled HTTP sessions
+    
+    With more than one search, each writes to its own search_<n>_<doc>_<year>
+    directory, since report file names only carry the time to the second.
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    search_dirs = [output_dir] * len(searches)
+    if len(searches) > 1:
+        search_dirs = [f"{output_dir}/search_{i}_{search['doc']}_{search['year']}".replace(' ', '_')
+                       for i, search in enumerate(searches, 1)]
+        for search_dir in search_dirs:
+            Path(search_dir).mkdir(parents=True, exist_ok=True)
+    started = time.monotonic()
+    
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=headless)
+        pool = EcHttpPool(p, browser, min(sessions, len(searches)) or 1, username, password)
+        try:
+            await pool.start()
+            results = await asyncio.gather(*[
+                pool.search(search['doc'], search['year'], search['sro'], search_dir)
+                for search, search_dir in zip(searches, search_dirs)
+            ], return_exceptions=True)
+        finally:
+            await pool.close()
+            await browser.close()
+            
+    results = [result if isinstance(result, dict) else {'success': False, 'message': f'{type(result).__name__}: {result}'}
+               for result in results]
+    print("\n" + "="*50)
+    print("HTTP EC Searches Complete")
+    print("="*50)
+    print(f"Searches: {len(results)} ({sum(1 for result in results if result['success'])} reports)")
+    print(f"Logins: {pool.logins}")
+    print(f"Wall time: {time.monotonic() - started:.1f}s")
+    print("="*50 + "\n")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='EC searches over HTTP after a browser login')
+    parser.add_argument('--doc', help='Document number')
+    parser.add_argument('--year', help='Year of registration')
+    parser.add_argument('--sro', help='SRO name (e.g., "HYDERABAD (R.O)")')
+    parser.add_argument('--batch', help='CSV file with doc,year,sro columns')
+    parser.add_argument('--sessions', type=int, default=2, help='Logged-in HTTP sessions to run in parallel')
+    parser.add_argument('--username', default=DEFAULT_USERNAME, help='Login username')
+    parser.add_argument('--password', default=DEFAULT_PASSWORD, help='Login password')
+    parser.add_argument('--headless', action='store_true', help='Run the login browser headless')
+    parser.add_argument('--output', default='output', help='Output directory')
+    
+    args = parser.parse_args()
+    
+    if args.batch:
+        with open(args.batch, 'r', encoding='utf-8') as f:
+            searches = [dict(row) for row in csv.DictReader(f)]
+    elif args.doc and args.year and args.sro:
+        searches = [{'doc': args.doc, 'year': args.year, 'sro': args.sro}]
+    else:
+        print("Error: give --doc, --year and --sro, or --batch")
+        sys.exit(1)
+        
+    # Check for Gemini API key
+    if not os.getenv('GEMINI_API_KEY'):
+        print("Error: GEMINI_API_KEY not found in environment variables")
+        print("Please create a .env file with: GEMINI_API_KEY=your-key-here")
+        sys.exit(1)
+        
+    asyncio.run(run_http_searches(
+        searches,
+        username=args.username,
+        password=args.password,
+        headless=args.headless,
+        output_dir=args.output,
+        sessions=args.sessions
+    ))
+
+
+if __name__ == '__main__':
+    main()
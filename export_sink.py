@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Streaming export of search results
+
+Appends CCLA result rows and EC documents to JSONL files as searches finish,
+and to Parquet files in row groups when pyarrow is installed, so a large
+crawl ends up as a handful of files instead of one JSON file per query.
+Only one row group per record kind is held in memory at a time.
+
+Each record kind has a versioned schema; the version is part of the file
+name and of every record.
+"""
+
+import json
+from datetime import datetime
+from pathlib import Path
+
+
+# Record schemas; bump the version whenever fields change
+SCHEMAS = {
+    'ccla_row': {
+        'version': 1,
+        'fields': [
+            'district', 'division', 'mandal', 'village', 'mode', 'buyer', 'seller',
+            'khataNo', 'surveyNo', 'ownerName', 'extent', 'landType', 'reasonForAmendment',
+            'timestamp', 'source',
+        ],
+    },
+    'ec_document': {
+        'version': 1,
+        'fields': [
+            'docNo', 'year', 'sro', 'documentId', 'requestNumber', 'documentCount',
+            'timestamp', 'source',
+        ],
+    },
+}
+
+
+# Fields stored as integers; every other field is a string
+INTEGER_FIELDS = {'documentCount'}
+
+
+def normalise_value(field: str, value):
+    """Value as its schema type (JSON inputs often give district or year as numbers)"""
+    if value is None:
+        return None
+    return int(value) if field in INTEGER_FIELDS else str(value)
+
+
+def ccla_rows(results: dict) -> list:
+    """Flatten a CCLA result into ccla_row records"""
+    query = results.get('query') or {}
+    rows = []
+    for record in results.get('data', []):
+        row = {field: query.get(field) for field in ('district', 'division', 'mandal', 'village',
+                                                     'mode', 'buyer', 'seller')}
+        row.update({key: (value or '').strip() for key, value in record.items()})
+        row['timestamp'] = results.get('timestamp')
+        row['source'] = results.get('html')
+        rows.append(row)
+    return rows
+
+
+def ec_documents(result: dict) -> list:
+    """Flatten an EC result into ec_document records"""
+    query = result.get('query') or {}
+    documents = result.get('documents') or []
+    return [{
+        'docNo': query.get('doc_no'),
+        'year': query.get('year'),
+        'sro': query.get('sro'),
+        'documentId': document_id,
+        'requestNumber': result.get('requestNumber'),
+        'documentCount': len(documents),
+        'timestamp': result.get('timestamp'),
+        'source': result.get('html'),
+    } for document_id in documents]
+
+
+class ExportSink:
+    """Appends records to per-kind JSONL and Parquet files as they are produced"""
+    
+    def __init__(self, output_dir: str = 'output', formats: tuple = ('jsonl', 'parquet'),
+                 batch_size: int = 1000):
+        self.export_dir = Path(output_dir) / 'export'
+        self.export_dir.mkdir(parents=True, exist_ok=True)
+        self.run = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.formats = set(formats)
+        self.batch_size = batch_size
+        self.counts = {kind: 0 for kind in SCHEMAS}
+        
+        self._jsonl = {}
+        self._batches = {kind: [] for kind in SCHEMAS}
+        self._parquet = {}
+        
+        if 'parquet' in self.formats:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                print("[EXPORT] ⚠️ pyarrow not installed, Parquet export skipped (pip install pyarrow)")
+                self.formats.discard('parquet')
+    
+    def _path(self, kind: str, extension: str) -> Path:
+        return self.export_dir / f"{kind}.v{SCHEMAS[kind]['version']}.{self.run}.{extension}"
+    
+    def append(self, kind: str, records: list):
+        """Append records of one kind, normalised to its schema"""
+        schema = SCHEMAS[kind]
+        for record in records:
+            row = {field: normalise_value(field, record.get(field)) for field in schema['fields']}
+            row['schemaVersion'] = schema['version']
+            
+            if 'jsonl' in self.formats:
+                if kind not in self._jsonl:
+                    self._jsonl[kind] = open(self._path(kind, 'jsonl'), 'a', encoding='utf-8')
+                self._jsonl[kind].write(json.dumps(row, ensure_ascii=False) + '\n')
+                
+            if 'parquet' in self.formats:
+                self._batches[kind].append(row)
+                if len(self._batches[kind]) >= self.batch_size:
+                    self._flush_parquet(kind)
+                    
+            self.counts[kind] += 1
+            
+        if kind in self._jsonl:
+            self._jsonl[kind].flush()
+    
+    def add_ccla(self, results: dict):
+        self.append('ccla_row', ccla_rows(results))
+    
+    def add_ec(self, result: dict):
+        self.append('ec_document', ec_documents(result))
+    
+    def _flush_parquet(self, kind: str):
+        batch = self._batches[kind]
+        if not batch:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        
+        if kind not in self._parquet:
+            schema = pa.schema(
+                [(field, pa.int64() if field in INTEGER_FIELDS else pa.string())
+                 for field in SCHEMAS[kind]['fields']] + [('schemaVersion', pa.int64())],
+                metadata={'schema': kind, 'version': str(SCHEMAS[kind]['version'])}
+            )
+            self._parquet[kind] = pq.ParquetWriter(str(self._path(kind, 'parquet')), schema)
+            
+        writer = self._parquet[kind]
+        columns = {name: [row.get(name) for row in batch] for name in writer.schema.names}
+        writer.write_table(pa.Table.from_pydict(columns, schema=writer.schema))
+        self._batches[kind] = []
+    
+    def close(self):
+        """Flush the last row groups and close every file"""
+        for kind in SCHEMAS:
+            if 'parquet' in self.formats:
+                self._flush_parquet(kind)
+        for writer in self._parquet.values():
+            writer.close()
+        for f in self._jsonl.values():
+            f.close()
+        summary = ', '.join(f'{count} {kind}' for kind, count in self.counts.items())
+        print(f"[EXPORT] 📦 {summary} exported to {self.export_dir}/")
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
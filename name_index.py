@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Local buyer/seller name index over stored CCLA results
+
+Owner names from every saved ccla_*.json result are indexed by location in
+a SQLite trigram index, so spelling variants of a name can be looked up
+instantly. Portal searches are name-filtered, so a search only covers the
+names it asked for: the portal is searched again for a name unless a
+similar buyer/seller query (a spelling variant) ran for that location within
+the freshness limit. New results are added to the index as they land.
+
+Usage:
+    python name_index.py sync --output output
+    python name_index.py search --name "Ramesh Kumar" --district 31 --division 67 --mandal 609 --village 3111005
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+
+DEFAULT_INDEX_PATH = 'output/name_index.sqlite'
+DEFAULT_MAX_AGE_DAYS = 30
+DEFAULT_MIN_SCORE = 0.45
+
+LOCATION_FIELDS = ('district', 'division', 'mandal', 'village')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS searches (
+    location_key TEXT NOT NULL,
+    query_key TEXT NOT NULL,
+    searched_at REAL NOT NULL,
+    PRIMARY KEY (location_key, query_key)
+);
+CREATE TABLE IF NOT EXISTS owners (
+    id INTEGER PRIMARY KEY,
+    location_key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    norm TEXT NOT NULL,
+    khata_no TEXT NOT NULL,
+    survey_no TEXT NOT NULL,
+    trigram_count INTEGER NOT NULL,
+    record TEXT NOT NULL,
+    source TEXT,
+    UNIQUE (location_key, norm, khata_no, survey_no)
+);
+CREATE TABLE IF NOT EXISTS trigrams (
+    trigram TEXT NOT NULL,
+    location_key TEXT NOT NULL,
+    owner_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS trigrams_lookup ON trigrams (trigram, location_key);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL
+);
+"""
+
+
+def normalize_name(name: str) -> str:
+    """Uppercase, punctuation-free, single-spaced name"""
+    return ' '.join(re.sub(r'[^A-Z0-9 ]', ' ', (name or '').upper()).split())
+
+
+def trigrams(name: str) -> set:
+    """Trigrams of each word of a normalized name, padded so short words still match"""
+    grams = set()
+    for word in normalize_name(name).split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a: str, b: str) -> float:
+    """Dice coefficient of two names' trigram sets"""
+    grams_a, grams_b = trigrams(a), trigrams(b)
+    if not grams_a or not grams_b:
+        return 0.0
+    return 2 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+
+def location_key(location: dict) -> str:
+    """Index key for a district/division/mandal/village location"""
+    return '/'.join(str(location.get(field) or '') for field in LOCATION_FIELDS)
+
+
+def query_key(buyer: str = None, seller: str = None) -> str:
+    """Key for the buyer/seller names a portal search was filtered on"""
+    return f'{normalize_name(buyer)}|{normalize_name(seller)}'
+
+
+class NameIndex:
+    """Trigram index of CCLA owner names, keyed by location"""
+    
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+    
+    def close(self):
+        self.db.close()
+    
+    def add_result(self, results: dict, source: str = None) -> int:
+        """Index the owner names of one CCLA result; returns the number of new names"""
+        query = results.get('query')
+        if not query:
+            return 0
+        key = location_key(query)
+        added = 0
+        
+        with self.db:
+            for record in results.get('data', []):
+                norm = normalize_name(record.get('ownerName'))
+                if not norm:
+                    continue
+                grams = trigrams(norm)
+                cursor = self.db.execute(
+                    "INSERT OR IGNORE INTO owners "
+                    "(location_key, name, norm, khata_no, survey_no, trigram_count, record, source) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, record['ownerName'].strip(), norm, record.get('khataNo', '').strip(),
+                     record.get('surveyNo', '').strip(), len(grams),
+                     json.dumps(record, ensure_ascii=False), source)
+                )
+                if cursor.rowcount:
+                    self.db.executemany(
+                        "INSERT INTO trigrams (trigram, location_key, owner_id) VALUES (?, ?, ?)",
+                        [(gram, key, cursor.lastrowid) for gram in grams]
+                    )
+                    added += 1
+                    
+            # Only the names this search asked for are covered, found or not; a page
+            # without a results table (e.g. a rejected CAPTCHA) covers nothing
+            answered = results.get('found') or results.get('message') == 'No records found'
+            if answered and query.get('mode') == 'buyerSeller' and (query.get('buyer') or query.get('seller')):
+                self.db.execute(
+                    "INSERT OR REPLACE INTO searches (location_key, query_key, searched_at) VALUES (?, ?, ?)",
+                    (key, query_key(query.get('buyer'), query.get('seller')), time.time())
+                )
+        return added
+    
+    def sync(self, output_dir: str = 'output') -> int:
+        """Index saved ccla_*.json results that are new or changed since the last sync
+        
+        Subdirectories are included (pipeline.py's parcel_<id>/, ccla_batch.py's worker_<n>/).
+        """
+        added = 0
+        for json_path in sorted(Path(output_dir).rglob('ccla_*.json')):
+            mtime = json_path.stat().st_mtime
+            row = self.db.execute("SELECT mtime FROM files WHERE path = ?", (str(json_path),)).fetchone()
+            if row and row[0] >= mtime:
+                continue
+            try:
+                with open(json_path, 'r', encoding='utf-8') as f:
+                    added += self.add_result(json.load(f), source=str(json_path))
+            except (OSError, ValueError) as e:
+                print(f"[INDEX] ⚠️ Skipping {json_path}: {e}")
+                continue
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO files (path, mtime) VALUES (?, ?)", (str(json_path), mtime)
+                )
+        return added
+    
+    def is_fresh(self, location: dict, buyer: str = None, seller: str = None,
+                 max_age_days: float = DEFAULT_MAX_AGE_DAYS, min_score: float = DEFAULT_MIN_SCORE) -> bool:
+        """Whether a similar buyer/seller search ran for the location within max_age_days
+        
+        Spelling variants count: each name must match the earlier search's
+        name as closely as search() requires (min_score), and a name left
+        empty must have been empty there too.
+        """
+        rows = self.db.execute(
+            "SELECT query_key FROM searches WHERE location_key = ? AND searched_at >= ?",
+            (location_key(location), time.time() - max_age_days * 86400)
+        ).fetchall()
+        wanted = query_key(buyer, seller).split('|')
+        for (key,) in rows:
+            searched = key.split('|')
+            if all(a == b if not (a and b) else similarity(a, b) >= min_score
+                   for a, b in zip(wanted, searched)):
+                return True
+        return False
+    
+    def search(self, name: str, location: dict = None, limit: int = 20,
+               min_score: float = DEFAULT_MIN_SCORE) -> list:
+        """Owners whose name is similar to name, best match first"""
+        grams = trigrams(name)
+        if not grams:
+            return []
+            
+        placeholders = ','.join('?' * len(grams))
+        sql = f"SELECT owner_id, COUNT(*) FROM trigrams WHERE trigram IN ({placeholders})"
+        params = list(grams)
+        if location:
+            sql += " AND location_key = ?"
+            params.append(location_key(location))
+        sql += " GROUP BY owner_id"
+        shared = dict(self.db.execute(sql, params).fetchall())
+        if not shared:
+            return []
+            
+        matches = []
+        rows = self.db.execute(
+            f"SELECT id, location_key, name, trigram_count, record FROM owners "
+            f"WHERE id IN ({','.join('?' * len(shared))})", list(shared)
+        ).fetchall()
+        for owner_id, key, owner_name, trigram_count, record in rows:
+            # Dice coefficient over trigram sets
+            score = 2 * shared[owner_id] / (len(grams) + trigram_count)
+            if score >= min_score:
+                matches.append({
+                    'score': round(score, 3),
+                    'ownerName': owner_name,
+                    'location': dict(zip(LOCATION_FIELDS, key.split('/'))),
+                    'record': json.loads(record),
+                })
+        matches.sort(key=lambda match: match['score'], reverse=True)
+        return matches[:limit]
+
+
+async def find_owner(
+    name: str,
+    location: dict,
+    index: NameIndex,
+    max_age_days: float = DEFAULT_MAX_AGE_DAYS,
+    headless: bool = True,
+    output_dir: str = 'output'
+) -> dict:
+    """Answer a name query from the index, searching the portal unless this name was searched recently"""
+    source = 'index'
+    if not index.is_fresh(location, buyer=name, max_age_days=max_age_days):
+        print(f"[INDEX] '{name}' not searched at {location_key(location)} or stale, searching the portal...")
+        from ccla_search import search_ccla
+        
+        results = await search_ccla(
+            **{field: location[field] for field in LOCATION_FIELDS},
+            mode='buyerSeller', buyer=name, headless=headless, output_dir=output_dir
+        )
+        index.add_result(results, source=results.get('html'))
+        source = 'portal'
+        
+    return {'name': name, 'location': location, 'source': source,
+            'matches': index.search(name, location)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local CCLA owner name index')
+    parser.add_argument('--index', default=DEFAULT_INDEX_PATH, help='Index database path')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    sync_parser = subparsers.add_parser('sync', help='Index new CCLA results from an output directory')
+    sync_parser.add_argument('--output', default='output', help='Output directory with ccla_*.json files')
+    
+    search_parser = subparsers.add_parser('search', help='Find owners by name')
+    search_parser.add_argument('--name', required=True, help='Buyer/seller name (any spelling)')
+    for field in LOCATION_FIELDS:
+        search_parser.add_argument(f'--{field}', help=f'{field.capitalize()} code')
+    search_parser.add_argument('--max-age', type=float, default=DEFAULT_MAX_AGE_DAYS,
+                               help='Days before a name is re-searched on the portal')
+    search_parser.add_argument('--offline', action='store_true', help='Never query the portal')
+    search_parser.add_argument('--output', default='output', help='Output directory')
+    
+    args = parser.parse_args()
+    index = NameIndex(args.index)
+    
+    try:
+        if args.command == 'sync':
+            added = index.sync(args.output)
+            print(f"[INDEX] ✓ {added} new owner names indexed")
+            return
+            
+        location = {field: getattr(args, field) for field in LOCATION_FIELDS}
+        has_location = all(location.values())
+        if not has_location and any(location.values()):
+            print("Error: give all of --district, --division, --mandal and --village, or none")
+            sys.exit(1)
+            
+        index.sync(args.output)
+        if has_location and not args.offline:
+            answer = asyncio.run(find_owner(args.name, location, index, args.max_age,
+                                            output_dir=args.output))
+        else:
+            answer = {'name': args.name, 'location': location if has_location else None,
+                      'source': 'index', 'matches': index.search(args.name, location if has_location else None)}
+        print(json.dumps(answer, indent=2, ensure_ascii=False))
+    finally:
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
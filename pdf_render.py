@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Deferred PDF rendering for saved EC reports
+
+Renders the HTML saved by capture_ec_report to PDF on a separate headless
+browser, either on request from the command line or in the background
+through a worker pool while searches keep running.
+
+Usage: python pdf_render.py output/ts_reg_ec_report_YYYYMMDD_HHMMSS.html [...]
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+
+# Same page setup the inline page.pdf call used
+PDF_OPTIONS = {
+    'format': 'A4',
+    'print_background': True,
+    'margin': {'top': '20px', 'bottom': '20px', 'left': '20px', 'right': '20px'},
+}
+
+
+def pdf_path_for(html_path: str) -> str:
+    """PDF path next to a saved HTML report"""
+    return str(Path(html_path).with_suffix('.pdf'))
+
+
+def base_url_for(html_path: str) -> str:
+    """Original page URL from the JSON saved next to the HTML report, if any"""
+    json_path = Path(html_path).with_suffix('.json')
+    if not json_path.exists():
+        return None
+    with open(json_path, 'r', encoding='utf-8') as f:
+        return json.load(f).get('url')
+
+
+async def render_page(page, html_path: str, pdf_path: str = None, base_url: str = None) -> str:
+    """Render one saved HTML report to PDF using an existing page"""
+    pdf_path = pdf_path or pdf_path_for(html_path)
+    with open(html_path, 'r', encoding='utf-8') as f:
+        html_content = f.read()
+        
+    # Resolve the portal's relative stylesheet and image links
+    if base_url and '<base ' not in html_content:
+        html_content = html_content.replace('<head>', f'<head><base href="{base_url}">', 1)
+        
+    await page.set_content(html_content, wait_until='load')
+    await page.pdf(path=pdf_path, **PDF_OPTIONS)
+    print(f"[PDF] 📄 PDF: {pdf_path}")
+    return pdf_path
+
+
+async def render_pdf(html_paths: list) -> list:
+    """Render saved HTML reports to PDF on request"""
+    from playwright.async_api import async_playwright
+    
+    pdf_paths = []
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        page = await browser.new_page()
+        try:
+            for html_path in html_paths:
+                pdf_paths.append(await render_page(page, html_path, base_url=base_url_for(html_path)))
+        finally:
+            await browser.close()
+    return pdf_paths
+
+
+class PdfRenderPool:
+    """Background workers rendering saved HTML reports on their own browser"""
+    
+    def __init__(self, browser, workers: int = 2):
+        self.browser = browser
+        self.queue = asyncio.Queue()
+        self.workers = [asyncio.ensure_future(self._worker()) for _ in range(workers)]
+    
+    def submit(self, html_path: str, pdf_path: str = None, base_url: str = None) -> asyncio.Future:
+        """Queue a report for rendering; the future resolves to the PDF path or None"""
+        future = asyncio.get_event_loop().create_future()
+        self.queue.put_nowait((html_path, pdf_path or pdf_path_for(html_path), base_url, future))
+        return future
+    
+    async def _worker(self):
+        page = await self.browser.new_page()
+        try:
+            while True:
+                item = await self.queue.get()
+                if item is None:
+                    break
+                html_path, pdf_path, base_url, future = item
+                try:
+                    future.set_result(await render_page(page, html_path, pdf_path, base_url))
+                except Exception as e:
+                    print(f"[PDF] ⚠️ Rendering {html_path} failed: {e}")
+                    future.set_result(None)
+        finally:
+            await page.close()
+    
+    async def close(self):
+        """Finish the queued reports and stop the workers"""
+        if self.queue.qsize():
+            print(f"[PDF] Waiting for {self.queue.qsize()} queued PDF(s)...")
+        for _ in self.workers:
+            self.queue.put_nowait(None)
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render saved EC report HTML to PDF')
+    parser.add_argument('html', nargs='+', help='Saved ts_reg_ec_report_*.html file(s)')
+    
+    args = parser.parse_args()
+    
+    missing = [path for path in args.html if not Path(path).exists()]
+    if missing:
+        print(f"Error: HTML file not found: {', '.join(missing)}")
+        sys.exit(1)
+        
+    asyncio.run(render_pdf(args.html))
+
+
+if __name__ == '__main__':
+    main()
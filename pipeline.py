@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Cross-portal parcel pipeline
+
+For each parcel, runs the CCLA land status search and the Registration EC
+search at the same time on separate browsers and sessions, then joins both
+outputs into one combined record per parcel, so a parcel takes about as long
+as the slower of the two searches rather than their sum.
+
+Parcels come from a CSV or JSON file with the fields:
+    id, district, division, mandal, village, mode, buyer, seller   (CCLA)
+    doc, year, sro                                                 (EC)
+Either half may be left empty to skip that portal for the parcel.
+
+Usage: python pipeline.py parcels.csv --headless
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from playwright.async_api import async_playwright
+
+from captcha_vote import CAPTCHA_STATS
+from ccla_search import run_ccla_search, search_failed, setup_page
+from concurrency import get_limiter
+from context_pool import DEFAULT_HEAP_BUDGET_MB, DEFAULT_MAX_SEARCHES, WorkerContext
+from export_sink import ExportSink
+from name_index import NameIndex
+from registration_search import DEFAULT_PASSWORD, DEFAULT_USERNAME, run_registration_search
+
+
+CCLA_FIELDS = ('district', 'division', 'mandal', 'village')
+EC_FIELDS = ('doc', 'year', 'sro')
+
+
+def load_parcels(path: str) -> list:
+    """Parcels from a CSV or JSON file, each with an id"""
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.lower().endswith('.json'):
+            parcels = json.load(f)
+        else:
+            parcels = [dict(row) for row in csv.DictReader(f)]
+            
+    for i, parcel in enumerate(parcels, 1):
+        parcel['id'] = str(parcel.get('id') or i)
+    return parcels
+
+
+async def make_workers(browser, count: int, context_options: dict, prefix: str,
+                       page_setup=None, memory_log: str = None, recycle: dict = None) -> asyncio.Queue:
+    """Queue of WorkerContexts sharing one browser
+    
+    recycle holds WorkerContext's max_searches / heap_budget_mb.
+    """
+    workers = asyncio.Queue()
+    for i in range(1, count + 1):
+        workers.put_nowait(WorkerContext(browser, f'{prefix}-{i}', context_options,
+                                         page_setup=page_setup, memory_log=memory_log, **(recycle or {})))
+    return workers
+
+
+async def run_on_worker(workers: asyncio.Queue, portal: str, search) -> dict:
+    """Run one search on a free worker under the portal's concurrency limit"""
+    async with get_limiter(portal).slot() as outcome:
+        worker = await workers.get()
+        try:
+            page = await worker.get_page()
+            result = await search(page, worker.context)
+            # CCLA results carry found/message rather than success
+            failed = search_failed(result) if portal == 'ccla' else result.get('success') is False
+            if failed:
+                outcome['error'] = result.get('message')
+            return result
+        finally:
+            await worker.search_done()
+            workers.put_nowait(worker)
+
+
+async def timed(coro) -> tuple:
+    """Result (or error) of a coroutine with its duration in seconds"""
+    started = time.monotonic()
+    try:
+        result = await coro
+    except Exception as e:
+        result = {'success': False, 'message': f'{type(e).__name__}: {e}'}
+    return result, round(time.monotonic() - started, 1)
+
+
+async def process_parcel(parcel: dict, ccla_workers: asyncio.Queue, ec_workers: asyncio.Queue,
+                         username: str, password: str, output_dir: str,
+                         sink: ExportSink = None, save_artifacts: bool = True,
+                         name_index: NameIndex = None) -> dict:
+    """Run both portal searches for a parcel concurrently and join the results"""
+    # Each parcel gets its own directory so concurrent searches never share file names
+    parcel_dir = f"{output_dir}/parcel_{parcel['id']}"
+    if save_artifacts:
+        Path(parcel_dir).mkdir(parents=True, exist_ok=True)
+    
+    async def skipped():
+        return None
+        
+    buyer = parcel.get('buyer') or None
+    seller = parcel.get('seller') or None
+    mode = parcel.get('mode') or ('buyerSeller' if buyer or seller else 'surveyNo')
+    if all(parcel.get(field) for field in CCLA_FIELDS):
+        ccla_task = run_on_worker(ccla_workers, 'ccla', lambda page, context: run_ccla_search(
+            page, parcel['district'], parcel['division'], parcel['mandal'], parcel['village'],
+            mode, buyer, seller, parcel_dir, name_index=name_index, sink=sink, save_artifacts=save_artifacts
+        ))
+    else:
+        ccla_task = skipped()
+        
+    if all(parcel.get(field) for field in EC_FIELDS):
+        ec_task = run_on_worker(ec_workers, 'registration', lambda page, context: run_registration_search(
+            page, context, parcel['doc'], parcel['year'], parcel['sro'], username, password, parcel_dir,
+            sink=sink, save_artifacts=save_artifacts
+        ))
+    else:
+        ec_task = skipped()
+        
+    started = time.monotonic()
+    (ccla, ccla_time), (ec, ec_time) = await asyncio.gather(timed(ccla_task), timed(ec_task))
+    wall = round(time.monotonic() - started, 1)
+    
+    print(f"[PIPELINE] Parcel {parcel['id']}: CCLA {ccla_time}s, EC {ec_time}s, wall {wall}s")
+    return {
+        'parcel': parcel['id'],
+        'input': parcel,
+        'ccla': ccla,
+        'ec': ec,
+        'timing': {'ccla': ccla_time, 'ec': ec_time, 'wall': wall},
+    }
+
+
+async def run_pipeline(
+    parcels: list,
+    username: str = DEFAULT_USERNAME,
+    password: str = DEFAULT_PASSWORD,
+    headless: bool = True,
+    output_dir: str = 'output',
+    ccla_workers: int = 2,
+    ec_workers: int = 1,
+    max_ccla_workers: int = None,
+    max_ec_workers: int = None,
+    export: bool = False,
+    save_artifacts: bool = True,
+    memory_log: str = None,
+    index_path: str = None,
+    max_searches: int = DEFAULT_MAX_SEARCHES,
+    heap_budget_mb: float = DEFAULT_HEAP_BUDGET_MB
+) -> str:
+    """Run all parcels and write the combined records to a JSONL file
+    
+    ccla_workers/ec_workers are the starting concurrency; each portal's
+    limiter raises it up to max_*_workers (default twice the start) while the
+    portal stays fast, and lowers it on slow responses and overload.
+    
+    With export on, CCLA rows and EC documents are also streamed to the
+    export_sink files; save_artifacts off skips the per-search files. Each
+    worker's memory samples are appended to memory_log, and its context is
+    recycled after max_searches or past heap_budget_mb of JS heap. With index_path,
+    CCLA owner names are added to that name_index.NameIndex as results land.
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    records_path = f"{output_dir}/parcels_{stamp}.jsonl"
+    memory_log = memory_log or f"{output_dir}/worker_memory_{stamp}.jsonl"
+    max_ccla_workers = max(max_ccla_workers or 2 * ccla_workers, ccla_workers)
+    max_ec_workers = max(max_ec_workers or 2 * ec_workers, ec_workers)
+    recycle = {'max_searches': max_searches, 'heap_budget_mb': heap_budget_mb}
+    
+    async with async_playwright() as p:
+        # Separate browsers keep the two portals' sessions and load apart
+        ccla_browser = await p.chromium.launch(headless=headless)
+        ec_browser = await p.chromium.launch(headless=headless)
+        # Pools are sized to the ceiling; the limiters decide how many run at once
+        ccla_pool = await make_workers(ccla_browser, max_ccla_workers, {'viewport': {'width': 1280, 'height': 900}}, 'ccla',
+                                       page_setup=setup_page, memory_log=memory_log, recycle=recycle)
+        ec_pool = await make_workers(ec_browser, max_ec_workers, {'viewport': {'width': 1400, 'height': 900}}, 'ec',
+                                     memory_log=memory_log, recycle=recycle)
+        get_limiter('ccla', initial=ccla_workers, maximum=max_ccla_workers)
+        get_limiter('registration', initial=ec_workers, maximum=max_ec_workers)
+        
+        sink = ExportSink(output_dir) if export else None
+        name_index = NameIndex(index_path) if index_path else None
+        started = time.monotonic()
+        sequential = 0.0
+        try:
+            with open(records_path, 'w', encoding='utf-8') as f:
+                tasks = [process_parcel(parcel, ccla_pool, ec_pool, username, password, output_dir,
+                                        sink, save_artifacts, name_index)
+                         for parcel in parcels]
+                for next_record in asyncio.as_completed(tasks):
+                    record = await next_record
+                    sequential += record['timing']['ccla'] + record['timing']['ec']
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    f.flush()
+        finally:
+            if sink:
+                sink.close()
+            if name_index:
+                name_index.close()
+            for pool in (ccla_pool, ec_pool):
+                while not pool.empty():
+                    await pool.get_nowait().close()
+            await ccla_browser.close()
+            await ec_browser.close()
+            
+    print("\n" + "="*50)
+    print("Pipeline Complete")
+    print("="*50)
+    print(f"Parcels: {len(parcels)}")
+    print(f"Wall time: {time.monotonic() - started:.1f}s (searches one after the other: {sequential:.1f}s)")
+    if CAPTCHA_STATS.submitted:
+        print(f"CAPTCHA: {CAPTCHA_STATS.summary()}")
+    print(f"Records: {records_path}")
+    print(f"Worker memory samples: {memory_log}")
+    print("="*50 + "\n")
+    return records_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run CCLA and EC searches concurrently per parcel')
+    parser.add_argument('parcels', help='CSV or JSON file of parcels')
+    parser.add_argument('--username', default=DEFAULT_USERNAME, help='Registration login username')
+    parser.add_argument('--password', default=DEFAULT_PASSWORD, help='Registration login password')
+    parser.add_argument('--headless', action='store_true', help='Run in headless mode')
+    parser.add_argument('--output', default='output', help='Output directory')
+    parser.add_argument('--ccla-workers', type=int, default=2, help='Concurrent CCLA searches to start with')
+    parser.add_argument('--ec-workers', type=int, default=1,
+                        help='Concurrent EC searches to start with (each worker holds its own login)')
+    parser.add_argument('--max-ccla-workers', type=int,
+                        help='Most concurrent CCLA searches while the portal is fast (default: twice --ccla-workers)')
+    parser.add_argument('--max-ec-workers', type=int,
+                        help='Most concurrent EC searches while the portal is fast (default: twice --ec-workers)')
+    parser.add_argument('--export', action='store_true', help='Stream results to JSONL/Parquet export files')
+    parser.add_argument('--no-artifacts', action='store_true',
+                        help='Skip per-search screenshot/HTML/JSON files')
+    parser.add_argument('--index', help='Name index database to add CCLA owner names to (e.g. output/name_index.sqlite)')
+    parser.add_argument('--max-searches', type=int, default=DEFAULT_MAX_SEARCHES,
+                        help='Searches before a worker context is recycled (0: never)')
+    parser.add_argument('--heap-budget-mb', type=float, default=DEFAULT_HEAP_BUDGET_MB,
+                        help="Worker page JS heap in MB above which its context is recycled (0: no budget)")
+    parser.add_argument('--memory-log', help='JSONL file for worker memory samples '
+                        '(default: worker_memory_<time>.jsonl in the output directory)')
+                        
+    args = parser.parse_args()
+    
+    parcels = load_parcels(args.parcels)
+    if any(all(parcel.get(field) for field in EC_FIELDS) for parcel in parcels) and not os.getenv('GEMINI_API_KEY'):
+        print("Error: GEMINI_API_KEY not found in environment variables")
+        print("Please create a .env file with: GEMINI_API_KEY=your-key-here")
+        sys.exit(1)
+        
+    asyncio.run(run_pipeline(
+        parcels,
+        username=args.username,
+        password=args.password,
+        headless=args.headless,
+        output_dir=args.output,
+        ccla_workers=args.ccla_workers,
+        ec_workers=args.ec_workers,
+        max_ccla_workers=args.max_ccla_workers,
+        max_ec_workers=args.max_ec_workers,
+        export=args.export,
+        save_artifacts=not args.no_artifacts,
+        memory_log=args.memory_log,
+        index_path=args.index,
+        max_searches=args.max_searches,
+        heap_budget_mb=args.heap_budget_mb
+    ))
+
+
+if __name__ == '__main__':
+    main()
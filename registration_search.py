@@ -16,22 +16,31 @@ from datetime import datetime
 from pathlib import Path
 
 from playwright.async_api import async_playwright, Page, BrowserContext
-import google.generativeai as genai
 from dotenv import load_dotenv
 
+from captcha_vote import CAPTCHA_STATS, is_valid_answer, vote
+from pdf_render import PdfRenderPool
+from replay import make_stub_solver, open_context, write_session_meta
+from response_capture import ResponseCapture, html_to_text, parse_input_values
 
-# Load environment variables
+
+# Load environment variables (the default credentials below read them)
 load_dotenv()
 
 # URLs
 LOGIN_URL = 'https://registration.telangana.gov.in/deptlogout.htm'
 DASHBOARD_URL = 'https://registration.telangana.gov.in/outsideIgrsDashboard.htm'
+EC_STATEMENT_URL = 'https://registration.telangana.gov.in/EncumbranceSearch.htm'
 EC_SEARCH_URL = 'https://registration.telangana.gov.in/EncumbranceCertificate/Search_Document.htm'
 
 # Default credentials
 DEFAULT_USERNAME = os.getenv('TS_REG_USERNAME', '7011590660')
 DEFAULT_PASSWORD = os.getenv('TS_REG_PASSWORD', 'Aarav@123')
 
+# CAPTCHA readings voted on per image, and the vote confidence needed to submit
+CAPTCHA_SAMPLES = int(os.getenv('TS_REG_CAPTCHA_SAMPLES', '1'))
+CAPTCHA_MIN_CONFIDENCE = float(os.getenv('TS_REG_CAPTCHA_MIN_CONFIDENCE', '0.6'))
+
 # Selectors
 SELECTORS = {
     'login': {
@@ -43,21 +52,31 @@ SELECTORS = {
         'loginButton': 'button[type="submit"], input[type="submit"]',
     },
     'searchMode': {
+        'form': 'input[name="docSel"]',
         'byDocumentNumber': 'input[name="docSel"][value="1"]',
     },
     'documentSearch': {
         'documentNo': '#doct',
         'yearOfRegistration': '#regyear',
         'sroAutocomplete': '#sroVal',
+        'sroSuggestion': '.ui-autocomplete li',
+    },
+    'documents': {
+        'checkbox': 'input[name="chkDocId"]',
     },
     'buttons': {
         'submit': 'button[type="submit"]',
+        'next': 'a:has-text("NEXT"), button:has-text("NEXT"), input[value*="NEXT" i]',
+        'statementSubmit': 'a:has-text("Submit"), a[href*="Search_Document"]',
     },
 }
 
 
 async def solve_captcha_with_gemini(image_bytes: bytes) -> str:
     """Solve CAPTCHA using Gemini AI"""
+    # Imported on first use so CCLA-only runs and --help skip the SDK import
+    import google.generativeai as genai
+    
     api_key = os.getenv('GEMINI_API_KEY')
     if not api_key:
         raise ValueError("GEMINI_API_KEY not found in environment variables")
@@ -87,7 +106,8 @@ What are the 6 characters in this CAPTCHA?"""
     import base64
     image_b64 = base64.b64encode(image_bytes).decode('utf-8')
     
-    response = model.generate_content([
+    # Async call so several readings of one image can run in parallel
+    response = await model.generate_content_async([
         {'mime_type': 'image/png', 'data': image_b64},
         prompt
     ])
@@ -99,29 +119,57 @@ What are the 6 characters in this CAPTCHA?"""
     return solution
 
 
-async def solve_captcha(page: Page, max_retries: int = 5) -> str:
-    """Solve CAPTCHA with retry logic"""
+# Solver used by solve_captcha; replay swaps in a stub that returns recorded answers
+captcha_solver = solve_captcha_with_gemini
+captcha_samples = CAPTCHA_SAMPLES
+
+
+async def wait_for_captcha_image(page: Page, timeout: int = 15000):
+    """CAPTCHA image element, once the image has finished loading"""
+    await page.wait_for_function(
+        """selector => {
+            const img = document.querySelector(selector);
+            return img && img.complete && img.naturalWidth > 0;
+        }""",
+        arg=SELECTORS['login']['captchaImage'], timeout=timeout
+    )
+    return await page.query_selector(SELECTORS['login']['captchaImage'])
+
+
+async def solve_captcha(page: Page, max_retries: int = 5) -> dict:
+    """Solve CAPTCHA with retry logic
+    
+    Takes captcha_samples readings of each image and votes on them; images
+    whose vote confidence is below CAPTCHA_MIN_CONFIDENCE are refreshed rather
+    than submitted, except on the last attempt. Returns the captcha_vote.vote
+    result (answer, confidence, readings).
+    """
     print("[TS-REG] Solving CAPTCHA...")
     
     for attempt in range(1, max_retries + 1):
         try:
-            captcha_element = await page.query_selector(SELECTORS['login']['captchaImage'])
-            if not captcha_element:
-                await page.wait_for_timeout(2000)
-                continue
-            
-            await page.wait_for_timeout(1000)
+            captcha_element = await wait_for_captcha_image(page)
             screenshot = await captcha_element.screenshot(type='png')
             
-            solution = await solve_captcha_with_gemini(screenshot)
+            readings = await asyncio.gather(
+                *[captcha_solver(screenshot) for _ in range(captcha_samples)], return_exceptions=True
+            )
+            if not any(isinstance(reading, str) for reading in readings):
+                raise readings[0]
+            result = vote([reading if isinstance(reading, str) else '' for reading in readings])
+            CAPTCHA_STATS.record_vote(result)
             
-            if solution and 4 <= len(solution) <= 8:
-                print(f"[TS-REG] ✓ CAPTCHA solved: {solution}")
-                return solution
+            if is_valid_answer(result['answer']):
+                if result['confidence'] >= CAPTCHA_MIN_CONFIDENCE or attempt == max_retries:
+                    print(f"[TS-REG] ✓ CAPTCHA solved: {result['answer']} (confidence {result['confidence']:.2f})")
+                    return result
+                print(f"[TS-REG] CAPTCHA {result['answer']} has low confidence "
+                      f"({result['confidence']:.2f}, readings {result['readings']}), refreshing...")
+                CAPTCHA_STATS.record_refresh()
             
-            # Refresh CAPTCHA
-            await captcha_element.click()
-            await page.wait_for_timeout(2000)
+            # Refresh CAPTCHA and wait for the new image
+            async with page.expect_response(lambda r: 'captcha' in r.url.lower(), timeout=10000):
+                await captcha_element.click()
             
         except Exception as e:
             print(f"[TS-REG] CAPTCHA attempt {attempt} failed: {e}")
@@ -129,74 +177,143 @@ async def solve_captcha(page: Page, max_retries: int = 5) -> str:
     raise Exception("CAPTCHA solving failed after all retries")
 
 
-async def login(page: Page, context: BrowserContext, username: str, password: str) -> bool:
-    """Login to portal"""
+async def login(page: Page, context: BrowserContext, username: str, password: str,
+                max_attempts: int = 3) -> bool:
+    """Login to portal, retrying up to max_attempts times on a rejected CAPTCHA"""
     print("[TS-REG] Logging in...")
     
     # Clear old cookies
     await context.clear_cookies()
     
-    # Go to login page
-    await page.goto(LOGIN_URL, wait_until='domcontentloaded', timeout=60000)
-    await page.wait_for_timeout(3000)
+    for attempt in range(1, max_attempts + 1):
+        # Go to login page
+        await page.goto(LOGIN_URL, wait_until='domcontentloaded', timeout=60000)
     
-    # Check if already logged in
-    if 'citizen_auth' in page.url or 'Dashboard' in page.url:
-        print("[TS-REG] ✓ Already logged in")
-        return True
-    
-    try:
-        # Select user type: Citizen (value="2")
-        await page.select_option(SELECTORS['login']['userType'], '2')
-        await page.wait_for_timeout(500)
-        
-        # Fill credentials
-        await page.fill(SELECTORS['login']['username'], username)
-        await page.fill(SELECTORS['login']['password'], password)
-        
-        # Solve CAPTCHA
-        captcha = await solve_captcha(page)
-        await page.fill(SELECTORS['login']['captchaInput'], captcha)
-        
-        # Click login
-        print("[TS-REG] Clicking login button...")
-        await page.evaluate("""
-            () => {
-                const btn = document.querySelector('button[type="submit"], input[type="submit"]');
-                if (btn) btn.click();
-            }
-        """)
-        
-        await page.wait_for_timeout(8000)
-        
-        # Check for invalid captcha
-        page_text = await page.evaluate("() => document.body.innerText")
-        if 'invalid captcha' in page_text.lower():
-            print("[TS-REG] Invalid CAPTCHA, retrying...")
-            await page.goto(LOGIN_URL, wait_until='domcontentloaded', timeout=60000)
-            await page.wait_for_timeout(2000)
-            return await login(page, context, username, password)
-        
-        # Check if login successful
-        new_url = page.url
-        is_logged_in = ('citizen_auth' in new_url or 'Dashboard' in new_url or 
-                       'outsideIgrsDashboard' in new_url or 'Welcome' in page_text or 
-                       'Encumbrance Search' in page_text)
-        
-        if is_logged_in:
-            print("[TS-REG] ✓ Login successful")
+        # Check if already logged in
+        if 'citizen_auth' in page.url or 'Dashboard' in page.url:
+            print("[TS-REG] ✓ Already logged in")
             return True
         
-        if 'deptlogout' in new_url:
-            print("[TS-REG] ✗ Login failed")
+        try:
+            # Solve the CAPTCHA as soon as its image loads, while the form is filled
+            captcha_task = asyncio.ensure_future(solve_captcha(page))
+            try:
+                # Select user type: Citizen (value="2")
+                await page.select_option(SELECTORS['login']['userType'], '2')
+                
+                # Fill credentials
+                await page.fill(SELECTORS['login']['username'], username)
+                await page.fill(SELECTORS['login']['password'], password)
+                
+                captcha = await captcha_task
+            finally:
+                if not captcha_task.done():
+                    captcha_task.cancel()
+                await asyncio.gather(captcha_task, return_exceptions=True)
+            await page.fill(SELECTORS['login']['captchaInput'], captcha['answer'])
+            
+            # Click login
+            print("[TS-REG] Clicking login button...")
+            
+            async def click_login():
+                await page.evaluate("""
+                    () => {
+                        const btn = document.querySelector('button[type="submit"], input[type="submit"]');
+                        if (btn) btn.click();
+                    }
+                """)
+                
+            # Done when the page moves on or reports the CAPTCHA as invalid
+            try:
+                await perform_and_wait(page, click_login, {'navigation': True, 'text': ['invalid captcha']}, 15000)
+            except Exception as e:
+                print(f"[TS-REG] ⚠️ No response to login: {e}")
+                
+            # Check for invalid captcha
+            page_text = await page.evaluate("() => document.body.innerText")
+            if 'invalid captcha' in page_text.lower():
+                CAPTCHA_STATS.record_submit(accepted=False)
+                print(f"[TS-REG] Invalid CAPTCHA (attempt {attempt}/{max_attempts})")
+                continue
+            CAPTCHA_STATS.record_submit(accepted=True)
+            
+            # Check if login successful
+            new_url = page.url
+            is_logged_in = ('citizen_auth' in new_url or 'Dashboard' in new_url or 
+                           'outsideIgrsDashboard' in new_url or 'Welcome' in page_text or 
+                           'Encumbrance Search' in page_text)
+                           
+            if is_logged_in:
+                print("[TS-REG] ✓ Login successful")
+                return True
+                
+            if 'deptlogout' in new_url:
+                print("[TS-REG] ✗ Login failed")
+                return False
+                
+            print("[TS-REG] ✓ Login appears successful")
+            return True
+            
+        except Exception as e:
+            print(f"[TS-REG] Login error: {e}")
             return False
         
-        print("[TS-REG] ✓ Login appears successful")
-        return True
-        
-    except Exception as e:
-        print(f"[TS-REG] Login error: {e}")
-        return False
+    print(f"[TS-REG] ✗ Login failed: CAPTCHA rejected {max_attempts} times")
+    return False
+
+
+async def perform_and_wait(page: Page, action, done: dict, timeout: int):
+    """Run an action and return as soon as any of its completion conditions is met
+
+    Supported conditions:
+        response   - URL substring of a network response
+        url        - URL substring the page navigates to
+        navigation - any main-frame navigation (True)
+        selector   - CSS selector that becomes attached
+        gone       - CSS selector that becomes detached
+        text       - list of lowercase substrings of the page text
+    """
+    waiters = []
+    if 'response' in done:
+        waiters.append(page.wait_for_response(lambda r: done['response'] in r.url, timeout=timeout))
+    if 'url' in done:
+        waiters.append(page.wait_for_url(lambda url: done['url'] in url, wait_until='domcontentloaded', timeout=timeout))
+    if done.get('navigation'):
+        waiters.append(page.wait_for_event('framenavigated', lambda frame: frame == page.main_frame, timeout=timeout))
+    if 'selector' in done:
+        waiters.append(page.wait_for_selector(done['selector'], state='attached', timeout=timeout))
+    if 'gone' in done:
+        waiters.append(page.wait_for_selector(done['gone'], state='detached', timeout=timeout))
+    if 'text' in done:
+        waiters.append(page.wait_for_function(
+            "texts => document.body && texts.some(t => document.body.innerText.toLowerCase().includes(t))",
+            arg=done['text'], timeout=timeout
+        ))
+    
+    # Arm the waiters before the action so fast responses are not missed
+    tasks = [asyncio.ensure_future(w) for w in waiters]
+    await asyncio.sleep(0)
+    
+    try:
+        if await action() is False or not tasks:
+            return
+        
+        pending = set(tasks)
+        errors = []
+        while pending:
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                if task.exception() is None:
+                    if done.get('navigation') or 'url' in done:
+                        await page.wait_for_load_state('domcontentloaded', timeout=timeout)
+                    return
+                errors.append(task.exception())
+        raise Exception(f"Condition {done} not met within {timeout} ms: {errors[0]}")
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 
 async def navigate_to_ec_search(page: Page) -> Page:
@@ -204,9 +321,7 @@ async def navigate_to_ec_search(page: Page) -> Page:
     print("[TS-REG] Navigating to EC Search...")
     
     # Go directly to EC Search URL
-    await page.goto('https://registration.telangana.gov.in/EncumbranceSearch.htm', 
-                   wait_until='domcontentloaded', timeout=60000)
-    await page.wait_for_timeout(3000)
+    await page.goto(EC_STATEMENT_URL, wait_until='domcontentloaded', timeout=60000)
     
     # Check for unauthorized
     page_text = await page.evaluate("() => document.body.innerText")
@@ -217,31 +332,29 @@ async def navigate_to_ec_search(page: Page) -> Page:
     if 'Encumbrance Statement' in page_text or 'EncumbranceSearch.htm' in page.url:
         print("[TS-REG] On EC Statement page, clicking Submit...")
         
-        await page.evaluate("""
-            () => {
-                const links = Array.from(document.querySelectorAll('a'));
-                for (const link of links) {
-                    if (link.textContent?.includes('Submit') || link.href?.includes('Search_Document')) {
-                        link.click();
-                        return true;
-                    }
-                }
-                return false;
-            }
-        """)
+        async def click_submit_link():
+            link = page.locator(SELECTORS['buttons']['statementSubmit']).first
+            if await link.count() == 0:
+                return False
+            await link.click()
         
-        await page.wait_for_timeout(5000)
+        try:
+            await perform_and_wait(page, click_submit_link, {
+                'selector': SELECTORS['searchMode']['form'],
+                'text': ['unauthorised access'],
+            }, 20000)
+        except Exception as e:
+            print(f"[TS-REG] Search form did not appear after Submit: {e}")
         
         page_text = await page.evaluate("() => document.body.innerText")
         if 'Unauthorised Access' in page_text:
             raise Exception('Session expired after Submit')
     
     # Verify search form loaded
-    has_form = await page.query_selector('input[name="docSel"]')
+    has_form = await page.query_selector(SELECTORS['searchMode']['form'])
     if not has_form:
         print("[TS-REG] Search form not found, trying direct URL...")
         await page.goto(EC_SEARCH_URL, wait_until='domcontentloaded', timeout=60000)
-        await page.wait_for_timeout(3000)
         
         page_text = await page.evaluate("() => document.body.innerText")
         if 'Unauthorised Access' in page_text:
@@ -251,12 +364,237 @@ async def navigate_to_ec_search(page: Page) -> Page:
     return page
 
 
+async def detect_ec_state(page: Page) -> str:
+    """Detect which page of the EC flow the browser is currently showing"""
+    markers = await page.evaluate("""
+        () => {
+            const text = document.body ? document.body.innerText : '';
+            const hasNext = Array.from(document.querySelectorAll('a, button, input')).some(el => {
+                const label = (el.textContent || el.value || '').toUpperCase();
+                return label.includes('NEXT');
+            });
+            return {
+                text: text,
+                searchForm: !!document.querySelector('input[name="docSel"]'),
+                documents: !!document.querySelector('input[name="chkDocId"]'),
+                next: hasNext,
+                submit: !!document.querySelector('button[type="submit"]'),
+            };
+        }
+    """)
+    text = markers['text']
+    lowered = text.lower()
+    
+    if 'Unauthorised Access' in text or 'Request denied' in text:
+        return 'unauthorised'
+    if 'Request Number' in text or 'Application Number' in text:
+        return 'report'
+    if 'no record' in lowered or 'not found' in lowered:
+        return 'no_records'
+    if markers['documents']:
+        return 'documents'
+    if markers['next']:
+        return 'results'
+    if markers['searchForm']:
+        return 'search_form'
+    if markers['submit']:
+        return 'date_range'
+    return 'unknown'
+
+
+async def ec_step_fill_form(page: Page, flow: dict):
+    """Step 1: Fill the document search form and submit it"""
+    print("[TS-REG] Step 1: Filling search form...")
+    await page.click(SELECTORS['searchMode']['byDocumentNumber'])
+    await page.wait_for_selector(SELECTORS['documentSearch']['documentNo'], state='visible', timeout=10000)
+    
+    await page.fill(SELECTORS['documentSearch']['documentNo'], flow['doc_no'])
+    await page.fill(SELECTORS['documentSearch']['yearOfRegistration'], flow['year'])
+    
+    # SRO autocomplete
+    sro_input = page.locator(SELECTORS['documentSearch']['sroAutocomplete']).first
+    await sro_input.click()
+    await sro_input.fill('')
+    await page.keyboard.type(flow['sro'], delay=30)
+    
+    # Click first dropdown item as soon as the suggestions render
+    dropdown_item = page.locator(SELECTORS['documentSearch']['sroSuggestion']).first
+    try:
+        await dropdown_item.wait_for(state='visible', timeout=5000)
+        await dropdown_item.click()
+    except Exception:
+        await sro_input.press('Enter')
+    
+    # Screenshot before submit
+    if flow['save_artifacts']:
+        await page.screenshot(path=f"{flow['output_dir']}/ts_reg_step1_form_{flow['timestamp']}.png", full_page=True)
+    
+    # Submit Step 1
+    print("[TS-REG] Submitting Step 1...")
+    await page.evaluate("() => { const btn = document.querySelector('button[type=\"submit\"]'); if (btn) btn.click(); }")
+
+
+async def ec_step_next(page: Page, flow: dict):
+    """Step 2: Click NEXT on the search results"""
+    print("[TS-REG] Step 2: Looking for NEXT button...")
+    next_button = page.locator(SELECTORS['buttons']['next']).first
+    if await next_button.count() == 0:
+        print("[TS-REG] No NEXT button found")
+        return False
+    
+    await next_button.click()
+    print("[TS-REG] Clicked NEXT...")
+
+
+async def ec_step_dates(page: Page, flow: dict):
+    """Step 3: Submit the date range"""
+    print("[TS-REG] Step 3: Submitting date range...")
+    await page.evaluate("() => { const btn = document.querySelector('button[type=\"submit\"]'); if (btn) btn.click(); }")
+
+
+async def ec_step_select_documents(page: Page, flow: dict):
+    """Step 4: Select all document checkboxes"""
+    print("[TS-REG] Step 4: Selecting document checkboxes...")
+    select_all_clicked = await page.evaluate("""
+        () => {
+            const selectAll = document.querySelector('#checkall2, input[name="checkall2"]');
+            if (selectAll) {
+                selectAll.click();
+                return true;
+            }
+            const checkboxes = document.querySelectorAll('input[name="chkDocId"]');
+            checkboxes.forEach(cb => { if (!cb.checked) cb.click(); });
+            return checkboxes.length > 0;
+        }
+    """)
+    print(f"[TS-REG] Checkboxes selected: {select_all_clicked}")
+    
+    # Extract document IDs from the documents page response, or the DOM if it wasn't captured
+    if flow.get('response'):
+        flow['documents'] = parse_input_values(flow['response']['body'], 'chkDocId')
+    else:
+        flow['documents'] = await page.evaluate("""
+            () => {
+                const checkboxes = document.querySelectorAll('input[name="chkDocId"]');
+                return Array.from(checkboxes).map(cb => cb.value).filter(v => v);
+            }
+        """)
+    print(f"[TS-REG] Documents found: {len(flow['documents'])}")
+
+
+async def ec_step_final_submit(page: Page, flow: dict):
+    """Step 5: Submit the selected documents for the final EC Report"""
+    print("[TS-REG] Step 5: Submitting for final EC Report...")
+    await page.evaluate("() => { const btn = document.querySelector('button[type=\"submit\"]'); if (btn) btn.click(); }")
+
+
+# EC flow steps in order: the action to run, the conditions that mark the
+# step complete (see perform_and_wait), how long to wait for them in ms and
+# the debug screenshot taken once the step completes
+EC_STEPS = [
+    {
+        'name': 'fill_form',
+        'action': ec_step_fill_form,
+        'done': {
+            'selector': f"{SELECTORS['buttons']['next']}, {SELECTORS['documents']['checkbox']}",
+            'text': ['no record', 'not found', 'unauthorised access'],
+        },
+        'timeout': 30000,
+        'screenshot': 'ts_reg_step1_result',
+    },
+    {
+        'name': 'next',
+        'action': ec_step_next,
+        'done': {'navigation': True, 'gone': SELECTORS['buttons']['next']},
+        'timeout': 30000,
+        'screenshot': 'ts_reg_step2_dates',
+    },
+    {
+        'name': 'dates',
+        'action': ec_step_dates,
+        'done': {
+            'selector': SELECTORS['documents']['checkbox'],
+            'text': ['no record', 'not found', 'unauthorised access'],
+        },
+        'timeout': 30000,
+        'screenshot': 'ts_reg_step3_documents',
+    },
+    {
+        'name': 'select_documents',
+        'action': ec_step_select_documents,
+        'done': {},
+        'timeout': 0,
+        'screenshot': 'ts_reg_step4_selected',
+    },
+    {
+        'name': 'final_submit',
+        'action': ec_step_final_submit,
+        'done': {
+            'navigation': True,
+            'text': ['request number', 'application number', 'unauthorised access'],
+        },
+        'timeout': 45000,
+    },
+]
+
+# Step index to resume from for each detected page state
+EC_RESUME_FROM_STATE = {
+    'search_form': 0,
+    'results': 1,
+    'date_range': 2,
+    'documents': 3,
+    'report': len(EC_STEPS),
+}
+
+
+async def resume_ec_step(page: Page, failed_step: int, flow: dict) -> int:
+    """Work out which step to resume from after a step failure
+    
+    Returns None when the portal answered with no records, which ends the search.
+    """
+    state = await detect_ec_state(page)
+    print(f"[TS-REG] Detected page state after failure: {state}")
+    
+    if state == 'unauthorised':
+        raise Exception('Session expired - Unauthorised Access')
+    if state == 'no_records':
+        return None
+    
+    if state in EC_RESUME_FROM_STATE:
+        resume = EC_RESUME_FROM_STATE[state]
+        # Step 4 already collected the documents, so re-submitting only needs step 5
+        if state == 'documents' and failed_step == 4 and flow['documents']:
+            resume = 4
+        return resume
+    
+    # Unknown page: back up one step in the browser history and re-detect
+    print("[TS-REG] Unknown page state, backing up one step...")
+    await page.go_back(wait_until='domcontentloaded', timeout=60000)
+    state = await detect_ec_state(page)
+    if state == 'no_records':
+        return None
+    if state in EC_RESUME_FROM_STATE:
+        return EC_RESUME_FROM_STATE[state]
+    return max(failed_step - 1, 0)
+
+
+def no_records_result(timestamp: str) -> dict:
+    return {
+        'success': False,
+        'message': 'No records found for this document',
+        'timestamp': timestamp
+    }
+
+
 async def search_by_document_number(
     page: Page,
     doc_no: str,
     year: str,
     sro: str,
-    output_dir: str
+    output_dir: str,
+    max_step_retries: int = 2,
+    pdf_pool: PdfRenderPool = None,
+    save_artifacts: bool = True
 ) -> dict:
     """Complete document number search flow"""
     print("\n" + "="*50)
@@ -267,161 +605,149 @@ async def search_by_document_number(
     
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     
+    # Checkpoint carried across steps and retries within this session
+    flow = {
+        'doc_no': doc_no,
+        'year': year,
+        'sro': sro,
+        'output_dir': output_dir,
+        'timestamp': timestamp,
+        'documents': [],
+        'response': None,
+        'save_artifacts': save_artifacts,
+    }
+    retries = {step_def['name']: 0 for step_def in EC_STEPS}
+    
+    # Step pages are parsed from their document responses instead of the DOM
+    capture = ResponseCapture(page, resource_types=('document',)).start()
+    
     try:
-        # Step 1: Fill search form
-        print("[TS-REG] Step 1: Filling search form...")
-        await page.click(SELECTORS['searchMode']['byDocumentNumber'])
-        await page.wait_for_timeout(1000)
-        
-        await page.fill(SELECTORS['documentSearch']['documentNo'], doc_no)
-        await page.fill(SELECTORS['documentSearch']['yearOfRegistration'], year)
-        
-        # SRO autocomplete
-        sro_input = page.locator(SELECTORS['documentSearch']['sroAutocomplete']).first
-        await sro_input.click()
-        await page.wait_for_timeout(500)
-        await sro_input.fill('')
-        await page.wait_for_timeout(300)
-        await page.keyboard.type(sro, delay=30)
-        await page.wait_for_timeout(2000)
-        
-        # Click first dropdown item
-        dropdown_item = page.locator('.ui-autocomplete li').first
-        if await dropdown_item.is_visible(timeout=3000):
-            await dropdown_item.click()
-        else:
-            await sro_input.press('Enter')
-        await page.wait_for_timeout(500)
-        
-        # Screenshot before submit
-        await page.screenshot(path=f"{output_dir}/ts_reg_step1_form_{timestamp}.png", full_page=True)
-        
-        # Submit Step 1
-        print("[TS-REG] Submitting Step 1...")
-        await page.evaluate("() => { const btn = document.querySelector('button[type=\"submit\"]'); if (btn) btn.click(); }")
-        await page.wait_for_timeout(8000)
-        
-        await page.screenshot(path=f"{output_dir}/ts_reg_step1_result_{timestamp}.png", full_page=True)
-        
-        # Check for errors
-        page_text = await page.evaluate("() => document.body.innerText")
-        if 'no record' in page_text.lower() or 'not found' in page_text.lower():
-            return {
-                'success': False,
-                'message': 'No records found for this document',
-                'timestamp': timestamp
-            }
-        
-        # Step 2: Click NEXT
-        print("[TS-REG] Step 2: Looking for NEXT button...")
-        next_clicked = await page.evaluate("""
-            () => {
-                const links = Array.from(document.querySelectorAll('a, button, input'));
-                for (const el of links) {
-                    const text = el.textContent?.toUpperCase() || el.value?.toUpperCase() || '';
-                    if (text.includes('NEXT')) {
-                        el.click();
-                        return true;
-                    }
-                }
-                return false;
-            }
-        """)
-        
-        if next_clicked:
-            print("[TS-REG] Clicked NEXT...")
-            await page.wait_for_timeout(6000)
-        else:
-            print("[TS-REG] No NEXT button found")
-        
-        await page.screenshot(path=f"{output_dir}/ts_reg_step2_dates_{timestamp}.png", full_page=True)
-        
-        # Step 3: Submit date range
-        print("[TS-REG] Step 3: Submitting date range...")
-        await page.evaluate("() => { const btn = document.querySelector('button[type=\"submit\"]'); if (btn) btn.click(); }")
-        await page.wait_for_timeout(8000)
-        
-        await page.screenshot(path=f"{output_dir}/ts_reg_step3_documents_{timestamp}.png", full_page=True)
-        
-        # Step 4: Select all checkboxes
-        print("[TS-REG] Step 4: Selecting document checkboxes...")
-        select_all_clicked = await page.evaluate("""
-            () => {
-                const selectAll = document.querySelector('#checkall2, input[name="checkall2"]');
-                if (selectAll) {
-                    selectAll.click();
-                    return true;
-                }
-                const checkboxes = document.querySelectorAll('input[name="chkDocId"]');
-                checkboxes.forEach(cb => { if (!cb.checked) cb.click(); });
-                return checkboxes.length > 0;
-            }
-        """)
-        print(f"[TS-REG] Checkboxes selected: {select_all_clicked}")
-        await page.wait_for_timeout(1000)
-        
-        # Extract document IDs
-        documents = await page.evaluate("""
-            () => {
-                const checkboxes = document.querySelectorAll('input[name="chkDocId"]');
-                return Array.from(checkboxes).map(cb => cb.value).filter(v => v);
-            }
-        """)
-        print(f"[TS-REG] Documents found: {len(documents)}")
-        
-        await page.screenshot(path=f"{output_dir}/ts_reg_step4_selected_{timestamp}.png", full_page=True)
-        
-        # Step 5: Final Submit
-        print("[TS-REG] Step 5: Submitting for final EC Report...")
-        await page.evaluate("() => { const btn = document.querySelector('button[type=\"submit\"]'); if (btn) btn.click(); }")
-        await page.wait_for_timeout(10000)
+        step = 0
+        while step < len(EC_STEPS):
+            step_def = EC_STEPS[step]
+            name = step_def['name']
+            try:
+                if step_def['done']:
+                    capture.latest.pop('document', None)
+                await perform_and_wait(
+                    page,
+                    lambda: step_def['action'](page, flow),
+                    step_def['done'],
+                    step_def['timeout']
+                )
+                if step_def['done']:
+                    await capture.drain()
+                    flow['response'] = capture.latest.get('document')
+            except Exception as e:
+                retries[name] += 1
+                if retries[name] > max_step_retries:
+                    raise Exception(f'Step {step + 1} ({name}) failed after {max_step_retries} retries: {e}')
+                print(f"[TS-REG] Step {step + 1} ({name}) failed: {e}")
+                step = await resume_ec_step(page, step, flow)
+                if step is None:
+                    return no_records_result(timestamp)
+                # Whatever arrived late (or nothing) replaces the previous step's response,
+                # so the next step and the report never parse a stale page
+                await capture.drain()
+                flow['response'] = capture.latest.get('document')
+                print(f"[TS-REG] Resuming from step {step + 1}")
+                continue
+            
+            if save_artifacts and step_def.get('screenshot'):
+                await page.screenshot(path=f"{output_dir}/{step_def['screenshot']}_{timestamp}.png", full_page=True)
+            
+            # Check for errors; an expired session would otherwise wait out the next steps' timeouts
+            state = await detect_ec_state(page)
+            if state == 'unauthorised':
+                raise Exception(f'Session expired - Unauthorised Access after step {step + 1} ({name})')
+            if name == 'fill_form' and state == 'no_records':
+                return no_records_result(timestamp)
+            step += 1
         
         # Capture final EC Report
-        return await capture_ec_report(page, output_dir, timestamp, documents)
+        report_html = flow['response']['body'] if flow['response'] else None
+        query = {'doc_no': doc_no, 'year': year, 'sro': sro}
+        return await capture_ec_report(page, output_dir, timestamp, flow['documents'], pdf_pool,
+                                       report_html, query, save_artifacts)
         
     except Exception as e:
         print(f"[TS-REG] Search error: {e}")
-        error_screenshot = f"{output_dir}/ts_reg_error_{timestamp}.png"
-        await page.screenshot(path=error_screenshot, full_page=True)
+        error_screenshot = None
+        if save_artifacts:
+            error_screenshot = f"{output_dir}/ts_reg_error_{timestamp}.png"
+            await page.screenshot(path=error_screenshot, full_page=True)
         return {
             'success': False,
             'message': f'Search failed: {str(e)}',
             'screenshot': error_screenshot,
             'timestamp': timestamp
         }
+    finally:
+        capture.stop()
 
 
-async def capture_ec_report(page: Page, output_dir: str, timestamp: str, documents: list) -> dict:
-    """Capture the final EC Report"""
-    print("[TS-REG] Capturing EC Report...")
+def record_pdf(result: dict, json_path: str, pdf_path: str):
+    """Record a deferred PDF's outcome in the result and its saved JSON"""
+    result['pdf'] = pdf_path
+    result['pdfStatus'] = 'rendered' if pdf_path else 'failed'
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+
+
+async def capture_ec_report(
+    page: Page,
+    output_dir: str,
+    timestamp: str,
+    documents: list,
+    pdf_pool: PdfRenderPool = None,
+    html_content: str = None,
+    query: dict = None,
+    save_artifacts: bool = True,
+    url: str = None
+) -> dict:
+    """Capture the final EC Report
     
-    base_path = f"{output_dir}/ts_reg_ec_report_{timestamp}"
+    The PDF is not rendered here: it is queued on pdf_pool when one is given,
+    otherwise it can be rendered later from the saved HTML with pdf_render.py.
+    html_content is the captured report response; without it the rendered
+    page is read instead. query (the search inputs) is stored with the
+    result. With save_artifacts off, no files are written.
     
-    # Screenshot
-    screenshot_path = f"{base_path}.png"
-    await page.screenshot(path=screenshot_path, full_page=True)
-    print(f"[TS-REG] 📸 Screenshot: {screenshot_path}")
+    page may be None when the report was fetched over HTTP (ec_http.py); the
+    report url is then given and no screenshot is taken.
+    """
+    print("[TS-REG] Capturing EC Report...")
     
-    # PDF (headless only)
-    pdf_path = None
-    try:
-        pdf_path = f"{base_path}.pdf"
-        await page.pdf(path=pdf_path, format='A4', print_background=True,
-                      margin={'top': '20px', 'bottom': '20px', 'left': '20px', 'right': '20px'})
-        print(f"[TS-REG] 📄 PDF: {pdf_path}")
-    except:
-        print("[TS-REG] PDF skipped (headless only)")
-        pdf_path = None
-    
-    # HTML
-    html_path = f"{base_path}.html"
-    html_content = await page.content()
-    with open(html_path, 'w', encoding='utf-8') as f:
-        f.write(html_content)
-    print(f"[TS-REG] 📝 HTML: {html_path}")
+    base_path = f"{output_dir}/ts_reg_ec_report_{timestamp}"
+    url = url or page.url
+    
+    if html_content is None:
+        html_content = await page.content()
+    
+    screenshot_path = None
+    html_path = None
+    if save_artifacts:
+        # Screenshot
+        if page is not None:
+            screenshot_path = f"{base_path}.png"
+            await page.screenshot(path=screenshot_path, full_page=True)
+            print(f"[TS-REG] 📸 Screenshot: {screenshot_path}")
+        
+        # HTML
+        html_path = f"{base_path}.html"
+        with open(html_path, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+        print(f"[TS-REG] 📝 HTML: {html_path}")
+        
+    # PDF (deferred, rendered from the saved HTML)
+    pdf_future = None
+    if pdf_pool and html_path:
+        pdf_future = pdf_pool.submit(html_path, f"{base_path}.pdf", base_url=url)
+        print(f"[TS-REG] 📄 PDF queued: {base_path}.pdf")
     
     # Extract data
-    page_text = await page.evaluate("() => document.body.innerText")
+    page_text = html_to_text(html_content)
     request_match = None
     for line in page_text.split('\n'):
         if 'Request Number' in line or 'Application Number' in line:
@@ -437,22 +763,74 @@ async def capture_ec_report(page: Page, output_dir: str, timestamp: str, documen
         'documents': documents,
         'requestNumber': request_match,
         'screenshot': screenshot_path,
-        'pdf': pdf_path,
+        # Filled in once the PDF is rendered; pdfStatus is pending, rendered or failed
+        'pdf': None,
+        'pdfStatus': 'pending' if pdf_future else None,
         'html': html_path,
+        'url': url,
+        'query': query,
         'timestamp': timestamp
     }
     
     # Save JSON
-    json_path = f"{base_path}.json"
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(result, f, indent=2)
-    print(f"[TS-REG] 📋 JSON: {json_path}")
+    json_path = None
+    if save_artifacts:
+        json_path = f"{base_path}.json"
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"[TS-REG] 📋 JSON: {json_path}")
+        
+    if pdf_future:
+        pdf_future.add_done_callback(
+            lambda future: record_pdf(result, json_path, None if future.cancelled() else future.result())
+        )
     
     print("[TS-REG] ========== EC REPORT CAPTURED ==========\n")
     
     return result
 
 
+async def run_registration_search(
+    page: Page,
+    context: BrowserContext,
+    doc_no: str,
+    year: str,
+    sro: str,
+    username: str = DEFAULT_USERNAME,
+    password: str = DEFAULT_PASSWORD,
+    output_dir: str = 'output',
+    pdf_pool: PdfRenderPool = None,
+    sink=None,
+    save_artifacts: bool = True
+) -> dict:
+    """Run one EC search on an existing page, reusing the context's session when it has one
+    
+    Found documents are appended to sink (an export_sink.ExportSink) when given.
+    """
+    ec_page = None
+    if await context.cookies(LOGIN_URL):
+        try:
+            ec_page = await navigate_to_ec_search(page)
+        except Exception as e:
+            print(f"[TS-REG] Saved session not usable ({e}), logging in again")
+            
+    if ec_page is None:
+        # Login
+        login_success = await login(page, context, username, password)
+        if not login_success:
+            return {'success': False, 'message': 'Login failed'}
+            
+        # Navigate to EC Search
+        ec_page = await navigate_to_ec_search(page)
+        
+    # Perform search
+    result = await search_by_document_number(ec_page, doc_no, year, sro, output_dir,
+                                             pdf_pool=pdf_pool, save_artifacts=save_artifacts)
+    if sink is not None and result['success']:
+        sink.add_ec(result)
+    return result
+
+
 async def search_registration(
     doc_no: str,
     year: str,
@@ -460,9 +838,18 @@ async def search_registration(
     username: str = DEFAULT_USERNAME,
     password: str = DEFAULT_PASSWORD,
     headless: bool = False,
-    output_dir: str = 'output'
+    output_dir: str = 'output',
+    render_pdf: bool = False,
+    record_har: str = None,
+    replay_har: str = None,
+    replay_speed: float = 1.0
 ):
-    """Main registration search function"""
+    """Main registration search function
+    
+    record_har saves the session's network traffic for replay.py; replay_har
+    serves it back offline, with the recorded CAPTCHA answers.
+    """
+    global captcha_solver, captcha_samples
     print("\n" + "="*50)
     print("Telangana Registration & Stamps Portal")
     print("="*50)
@@ -473,22 +860,31 @@ async def search_registration(
     # Create output directory
     Path(output_dir).mkdir(exist_ok=True)
     
+    if record_har:
+        # No credentials: the replayed login POST is answered from the archive
+        write_session_meta(record_har, 'registration', {'doc_no': doc_no, 'year': year, 'sro': sro})
+    if replay_har:
+        captcha_solver = make_stub_solver(replay_har)
+        captcha_samples = 1
+        
     async with async_playwright() as p:
         browser = await p.chromium.launch(headless=headless, slow_mo=50 if not headless else 0)
-        context = await browser.new_context(viewport={'width': 1400, 'height': 900})
+        context = await open_context(browser, {'viewport': {'width': 1400, 'height': 900}},
+                                     record_har, replay_har, replay_speed)
         page = await context.new_page()
         
-        try:
-            # Login
-            login_success = await login(page, context, username, password)
-            if not login_success:
-                return {'success': False, 'message': 'Login failed'}
-            
-            # Navigate to EC Search
-            ec_page = await navigate_to_ec_search(page)
+        # PDFs render on a separate headless browser so the search never waits on them
+        pdf_browser = None
+        pdf_pool = None
+        if render_pdf:
+            pdf_browser = await p.chromium.launch(headless=True)
+            pdf_pool = PdfRenderPool(pdf_browser)
             
-            # Perform search
-            result = await search_by_document_number(ec_page, doc_no, year, sro, output_dir)
+        try:
+            result = await run_registration_search(page, context, doc_no, year, sro,
+                                                   username, password, output_dir, pdf_pool)
+            if result['message'] == 'Login failed':
+                return result
             
             print("\n" + "="*50)
             print("Search Complete")
@@ -499,14 +895,15 @@ async def search_registration(
                 print(f"Documents: {len(result['documents'])}")
             if result.get('screenshot'):
                 print(f"Screenshot: {result['screenshot']}")
-            if result.get('pdf'):
-                print(f"PDF: {result['pdf']}")
+            if result.get('pdfStatus'):
+                print(f"PDF: {result['pdf'] or result['pdfStatus']}")
             if result.get('html'):
                 print(f"HTML: {result['html']}")
+            print(f"CAPTCHA: {CAPTCHA_STATS.summary()}")
             print("="*50 + "\n")
             
             # Keep browser open for inspection if headed
-            if not headless:
+            if not headless and not replay_har:
                 print("[TS-REG] Browser open for 30 seconds for inspection...")
                 await page.wait_for_timeout(30000)
             
@@ -519,7 +916,15 @@ async def search_registration(
             print(f"[TS-REG] 📸 Error screenshot: {error_screenshot}")
             raise
         finally:
+            # Closing the context writes the recorded HAR
+            await context.close()
             await browser.close()
+            if pdf_pool:
+                await pdf_pool.close()
+                await pdf_browser.close()
+            if replay_har:
+                captcha_solver = solve_captcha_with_gemini
+                captcha_samples = CAPTCHA_SAMPLES
 
 
 def main():
@@ -531,6 +936,8 @@ def main():
     parser.add_argument('--password', default=DEFAULT_PASSWORD, help='Login password')
     parser.add_argument('--headless', action='store_true', help='Run in headless mode')
     parser.add_argument('--output', default='output', help='Output directory')
+    parser.add_argument('--pdf', action='store_true', help='Render the EC report PDF in the background')
+    parser.add_argument('--record', metavar='HAR', help='Record the session for offline replay (replay.py)')
     
     args = parser.parse_args()
     
@@ -548,7 +955,9 @@ def main():
         username=args.username,
         password=args.password,
         headless=args.headless,
-        output_dir=args.output
+        output_dir=args.output,
+        render_pdf=args.pdf,
+        record_har=args.record
     ))
 
 
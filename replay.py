@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Record-and-replay of portal sessions
+
+Record mode saves every network exchange of a real search_ccla or
+search_registration session into a HAR archive (with bodies and timings)
+plus a small .meta.json holding the search arguments. Replay mode routes
+every request of a new browser context to the archive, serving the
+recorded responses after their original latency (optionally scaled), with
+the Registration CAPTCHA answered by a stub solver that returns the
+recorded answers. A recorded search can then be re-run offline and timed
+deterministically.
+
+Usage:
+    python ccla_search.py ... --record archives/ccla.har
+    python replay.py archives/ccla.har --runs 5 --speed 0
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import statistics
+import sys
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+
+# Response headers that no longer apply once the body is served decoded
+DROPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding'}
+
+# Form fields that carry a typed CAPTCHA answer
+CAPTCHA_FIELDS = ('captcha', 'captchaText', 'captchaValue')
+
+
+def meta_path(har_path: str) -> Path:
+    return Path(f"{har_path}.meta.json")
+
+
+def write_session_meta(har_path: str, portal: str, arguments: dict):
+    """Save what was searched next to the archive so it can be replayed"""
+    with open(meta_path(har_path), 'w', encoding='utf-8') as f:
+        json.dump({'portal': portal, 'arguments': arguments}, f, indent=2)
+
+
+def load_entries(har_path: str) -> list:
+    with open(har_path, 'r', encoding='utf-8') as f:
+        return json.load(f)['log']['entries']
+
+
+def _post_data(request: dict) -> str:
+    return (request.get('postData') or {}).get('text') or ''
+
+
+def _keys(method: str, url: str, post_data: str) -> list:
+    """Match keys from most to least specific"""
+    parts = urlsplit(url)
+    path = f"{parts.scheme}://{parts.netloc}{parts.path}"
+    return [
+        (method, url, post_data),
+        (method, url),
+        (method, path),
+    ]
+
+
+class ReplayRouter:
+    """Serves a context's requests from a recorded HAR archive"""
+    
+    def __init__(self, har_path: str, speed: float = 1.0):
+        self.speed = speed
+        self.served = 0
+        self.missed = []
+        self._queues = defaultdict(deque)
+        self._last = {}
+        self._used = set()
+        
+        for entry in load_entries(har_path):
+            request = entry['request']
+            for key in _keys(request['method'], request['url'], _post_data(request)):
+                self._queues[key].append(entry)
+    
+    def _take(self, method: str, url: str, post_data: str) -> dict:
+        # Repeated requests get the recorded responses in order, then the last one again
+        for key in _keys(method, url, post_data):
+            queue = self._queues.get(key)
+            # Entries are queued under every key, so skip ones already served through another
+            while queue and id(queue[0]) in self._used:
+                queue.popleft()
+            if queue:
+                entry = queue.popleft()
+                self._used.add(id(entry))
+                self._last[key] = entry
+                return entry
+            if key in self._last:
+                return self._last[key]
+        return None
+    
+    async def handle(self, route):
+        request = route.request
+        entry = self._take(request.method, request.url, request.post_data or '')
+        if entry is None:
+            self.missed.append(f"{request.method} {request.url}")
+            print(f"[REPLAY] ⚠️ Not in archive, aborted: {request.method} {request.url}")
+            await route.abort()
+            return
+            
+        if self.speed:
+            await asyncio.sleep(max(entry.get('time', 0), 0) / 1000 * self.speed)
+            
+        response = entry['response']
+        content = response.get('content', {})
+        body = content.get('text') or ''
+        body = base64.b64decode(body) if content.get('encoding') == 'base64' else body.encode('utf-8')
+        headers = {header['name']: header['value'] for header in response.get('headers', [])
+                   if header['name'].lower() not in DROPPED_HEADERS}
+                   
+        self.served += 1
+        await route.fulfill(status=response['status'], headers=headers, body=body)
+
+
+def make_stub_solver(har_path: str):
+    """CAPTCHA solver that returns the answers typed during the recording, in order"""
+    answers = deque()
+    for entry in load_entries(har_path):
+        if entry['request']['method'] != 'POST':
+            continue
+        fields = parse_qs(_post_data(entry['request']))
+        for name in CAPTCHA_FIELDS:
+            if fields.get(name):
+                answers.append(fields[name][0])
+                break
+    
+    async def solve(image_bytes: bytes) -> str:
+        if not answers:
+            raise Exception("No recorded CAPTCHA answers left in the archive")
+        return answers.popleft() if len(answers) > 1 else answers[0]
+        
+    return solve
+
+
+async def open_context(browser, context_options: dict, record_har: str = None,
+                       replay_har: str = None, replay_speed: float = 1.0):
+    """New browser context that records to or replays from a HAR archive"""
+    options = dict(context_options)
+    if record_har:
+        Path(record_har).parent.mkdir(parents=True, exist_ok=True)
+        options.update(record_har_path=record_har, record_har_content='embed')
+        
+    context = await browser.new_context(**options)
+    if replay_har:
+        router = ReplayRouter(replay_har, replay_speed)
+        await context.route('**/*', router.handle)
+        context.replay_router = router
+        print(f"[REPLAY] Serving requests from {replay_har} (speed x{replay_speed})")
+    return context
+
+
+async def run_replay(har_path: str, runs: int = 1, speed: float = 1.0, output_dir: str = 'replay_output') -> list:
+    """Re-run a recorded search offline and report its durations"""
+    with open(meta_path(har_path), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+        
+    if meta['portal'] == 'ccla':
+        from ccla_search import search_ccla as search
+    else:
+        from registration_search import search_registration as search
+        
+    arguments = dict(meta['arguments'], headless=True, output_dir=output_dir)
+    durations = []
+    for run in range(1, runs + 1):
+        started = time.monotonic()
+        await search(**arguments, replay_har=har_path, replay_speed=speed)
+        durations.append(time.monotonic() - started)
+        print(f"[REPLAY] Run {run}/{runs}: {durations[-1]:.2f}s")
+        
+    print("\n" + "="*50)
+    print("Replay Benchmark")
+    print("="*50)
+    print(f"Archive: {har_path} ({meta['portal']})")
+    print(f"Runs: {runs}, speed x{speed}")
+    print(f"Median: {statistics.median(durations):.2f}s, min {min(durations):.2f}s, max {max(durations):.2f}s")
+    print("="*50 + "\n")
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded portal session offline')
+    parser.add_argument('archive', help='HAR archive recorded with --record')
+    parser.add_argument('--runs', type=int, default=1, help='Number of replays to time')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Latency scale: 1 = recorded timings, 0.5 = twice as fast, 0 = no delay')
+    parser.add_argument('--output', default='replay_output', help='Output directory')
+    
+    args = parser.parse_args()
+    
+    if not meta_path(args.archive).exists():
+        print(f"Error: {meta_path(args.archive)} not found; record the session with --record first")
+        sys.exit(1)
+        
+    asyncio.run(run_replay(args.archive, args.runs, args.speed, args.output))
+
+
+if __name__ == '__main__':
+    main()
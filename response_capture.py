@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Network response capture for portal pages
+
+Subscribes to the responses a page already receives (dropdown XHRs, form
+posts, EC step pages) and parses data straight from their payloads, so
+callers can continue as soon as the data arrives instead of sleeping and
+re-reading the rendered DOM.
+"""
+
+import asyncio
+import json
+import re
+from html import unescape
+from html.parser import HTMLParser
+
+
+class ResponseCapture:
+    """Collects response payloads of the given resource types on a page"""
+    
+    def __init__(self, page, resource_types: tuple = ('document', 'xhr', 'fetch')):
+        self.page = page
+        self.resource_types = resource_types
+        self.latest = {}
+        self._waiters = []
+        self._tasks = set()
+    
+    def start(self):
+        self.page.on('response', self._on_response)
+        return self
+    
+    def stop(self):
+        self.page.remove_listener('response', self._on_response)
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+        for _, future in self._waiters:
+            if not future.done():
+                future.cancel()
+        self._waiters.clear()
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc):
+        self.stop()
+    
+    def _on_response(self, response):
+        resource_type = response.request.resource_type
+        if resource_type not in self.resource_types:
+            return
+        if resource_type == 'document' and response.frame != self.page.main_frame:
+            return
+        # Read the body right away, before a later navigation evicts it
+        task = asyncio.ensure_future(self._read(response, resource_type))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _read(self, response, resource_type: str):
+        try:
+            body = await response.text()
+        except Exception:
+            # Redirects and aborted requests have no body
+            return
+            
+        payload = {
+            'url': response.url,
+            'status': response.status,
+            'method': response.request.method,
+            'type': resource_type,
+            'body': body,
+        }
+        self.latest[resource_type] = payload
+        
+        for waiter in list(self._waiters):
+            predicate, future = waiter
+            if not future.done() and predicate(payload):
+                future.set_result(payload)
+                self._waiters.remove(waiter)
+    
+    async def drain(self):
+        """Wait until the bodies of responses already received have been read"""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+    
+    async def expect(self, action, predicate=None, timeout: int = 30000) -> dict:
+        """Run an action and return the first matching response payload
+        
+        Raises asyncio.TimeoutError if nothing matching arrives in time.
+        """
+        future = asyncio.get_event_loop().create_future()
+        waiter = (predicate or (lambda payload: True), future)
+        self._waiters.append(waiter)
+        try:
+            await action()
+            return await asyncio.wait_for(future, timeout / 1000)
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+
+class _TableParser(HTMLParser):
+    """Collects tables, select options, input fields, forms and links from an HTML payload"""
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tables = []
+        self.options = []
+        self.inputs = []
+        self.forms = []
+        self.links = []
+        self._table_stack = []
+        self._row = None
+        self._cell = None
+        self._option = None
+        self._form = None
+        self._select = None
+        self._label = None
+    
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'table':
+            self._table_stack.append({'headers': [], 'rows': []})
+        elif tag == 'tr' and self._table_stack:
+            self._row = []
+        elif tag in ('td', 'th') and self._row is not None:
+            self._cell = {'tag': tag, 'text': []}
+        elif tag == 'option':
+            self._option = {'value': attrs.get('value'), 'text': [], 'selected': 'selected' in attrs}
+        elif tag == 'input':
+            self.inputs.append(attrs)
+            if self._form is not None:
+                self._form['fields'].append(attrs)
+        elif tag == 'form':
+            self._form = {'action': attrs.get('action') or '', 'method': (attrs.get('method') or 'get').upper(),
+                          'id': attrs.get('id'), 'name': attrs.get('name'), 'fields': []}
+            self.forms.append(self._form)
+        elif tag == 'select':
+            self._select = {'tag': 'select', 'name': attrs.get('name'), 'id': attrs.get('id'), 'options': []}
+            if self._form is not None:
+                self._form['fields'].append(self._select)
+        elif tag in ('a', 'button'):
+            # Links and buttons are kept with their label text
+            self._label = dict(attrs, tag=tag, text=[])
+            if tag == 'a':
+                self.links.append(self._label)
+            elif self._form is not None:
+                self._form['fields'].append(self._label)
+    
+    def handle_endtag(self, tag):
+        if tag in ('td', 'th') and self._cell is not None and self._row is not None:
+            self._row.append(self._cell)
+            self._cell = None
+        elif tag == 'tr' and self._row is not None and self._table_stack:
+            table = self._table_stack[-1]
+            texts = [' '.join(''.join(cell['text']).split()) for cell in self._row]
+            if self._row and all(cell['tag'] == 'th' for cell in self._row):
+                table['headers'].extend(texts)
+            elif any(cell['tag'] == 'td' for cell in self._row):
+                table['rows'].append(texts)
+            self._row = None
+        elif tag == 'table' and self._table_stack:
+            self.tables.append(self._table_stack.pop())
+        elif tag == 'option' and self._option is not None:
+            text = ' '.join(''.join(self._option['text']).split())
+            value = self._option['value'] if self._option['value'] is not None else text
+            self.options.append({'value': value, 'label': text})
+            if self._select is not None:
+                self._select['options'].append({'value': value, 'label': text, 'selected': self._option['selected']})
+            self._option = None
+        elif tag == 'form':
+            self._form = None
+        elif tag == 'select':
+            self._select = None
+        elif tag in ('a', 'button') and self._label is not None:
+            self._label['text'] = ' '.join(''.join(self._label['text']).split())
+            self._label = None
+    
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell['text'].append(data)
+        if self._option is not None:
+            self._option['text'].append(data)
+        if self._label is not None:
+            self._label['text'].append(data)
+
+
+def parse_html(body: str) -> _TableParser:
+    parser = _TableParser()
+    parser.feed(body or '')
+    parser.close()
+    return parser
+
+
+def parse_options(body: str) -> list:
+    """Dropdown options from a JSON or HTML <option> payload"""
+    text = (body or '').strip()
+    if text[:1] in ('[', '{'):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            data = next((v for v in data.values() if isinstance(v, list)), [])
+        if isinstance(data, list):
+            options = []
+            for item in data:
+                if isinstance(item, dict):
+                    values = list(item.values())
+                    options.append({
+                        'value': str(values[0]) if values else '',
+                        'label': str(values[1]) if len(values) > 1 else str(values[0]) if values else '',
+                    })
+                else:
+                    options.append({'value': str(item), 'label': str(item)})
+            return options
+    return parse_html(text).options
+
+
+def parse_tables(body: str) -> list:
+    """Tables in an HTML payload as {'headers': [...], 'rows': [[...], ...]}"""
+    return parse_html(body).tables
+
+
+def parse_input_values(body: str, name: str) -> list:
+    """Non-empty values of the input fields with the given name"""
+    return [attrs['value'] for attrs in parse_html(body).inputs
+            if attrs.get('name') == name and attrs.get('value')]
+
+
+def parse_forms(body: str) -> list:
+    """Forms in an HTML payload as {'action', 'method', 'id', 'name', 'fields'}
+    
+    Fields are input attribute dicts, plus {'tag': 'select', 'options': [...]}
+    and {'tag': 'button', ...} entries.
+    """
+    return parse_html(body).forms
+
+
+def parse_links(body: str) -> list:
+    """Links in an HTML payload as attribute dicts with their label 'text'"""
+    return parse_html(body).links
+
+
+def form_pairs(form: dict, overrides: dict = None, submitter: dict = None) -> list:
+    """(name, value) pairs a browser would submit for a parsed form
+    
+    overrides replaces the values of the named fields (a list value submits
+    the name once per item); submitter is the clicked submit control, if any.
+    """
+    overrides = overrides or {}
+    pairs = []
+    for field in form['fields']:
+        name = field.get('name')
+        if not name or name in overrides or 'disabled' in field:
+            continue
+        kind = (field.get('type') or ('submit' if field.get('tag') == 'button' else 'text')).lower()
+        if field.get('tag') == 'select':
+            selected = [option for option in field['options'] if option['selected']] or field['options'][:1]
+            pairs.extend((name, option['value']) for option in selected)
+        elif kind in ('submit', 'image', 'button', 'reset', 'file'):
+            if field is submitter:
+                pairs.append((name, field.get('value') or ''))
+        elif kind in ('checkbox', 'radio'):
+            if 'checked' in field:
+                pairs.append((name, field.get('value') or 'on'))
+        else:
+            pairs.append((name, field.get('value') or ''))
+            
+    for name, value in overrides.items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        pairs.extend((name, str(item)) for item in values)
+    return pairs
+
+
+def html_to_text(body: str) -> str:
+    """Rough innerText of an HTML payload"""
+    body = re.sub(r'(?is)<(script|style)\b.*?</\1>', ' ', body or '')
+    body = re.sub(r'(?i)<br\s*/?>|</(p|div|tr|li|h\d|table)>', '\n', body)
+    return unescape(re.sub(r'<[^>]+>', ' ', body))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+HTTP search service
+
+Runs CCLA and EC searches on request and answers with the result JSON, so
+other jobs can query the portals without starting a Python process each time.
+Each request runs in its own thread with its own headless browser and
+writes its files to its own output/<request id>/ directory.
+
+    POST /ccla  {"district": "31", "division": "67", "mandal": "609", "village": "3111005", "buyer": "Kumar"}
+    POST /ec    {"doc_no": "1234", "year": "2024", "sro": "HYDERABAD"}
+    GET  /health
+
+Usage: python server.py --port 8080
+"""
+
+import argparse
+import asyncio
+import json
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+CCLA_FIELDS = ('district', 'division', 'mandal', 'village', 'mode', 'buyer', 'seller')
+EC_FIELDS = ('doc_no', 'year', 'sro', 'username', 'password')
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    """Maps POST /ccla and /ec to a headless search"""
+    
+    output_dir = 'output'
+    
+    def _reply(self, status: int, body: dict):
+        data = json.dumps(body, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def do_GET(self):
+        if self.path == '/health':
+            self._reply(200, {'status': 'ok'})
+        else:
+            self._reply(404, {'error': 'Not found'})
+    
+    def do_POST(self):
+        if self.path == '/ccla':
+            from ccla_search import search_ccla as search
+            fields = CCLA_FIELDS
+        elif self.path == '/ec':
+            from registration_search import search_registration as search
+            fields = EC_FIELDS
+        else:
+            self._reply(404, {'error': 'Not found'})
+            return
+            
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            params = json.loads(self.rfile.read(length) or b'{}')
+            arguments = {field: params[field] for field in fields if params.get(field)}
+            # Result files are named by the second, so concurrent requests each get a directory
+            request_dir = f"{self.output_dir}/{uuid.uuid4().hex}"
+            Path(request_dir).mkdir(parents=True, exist_ok=True)
+            result = asyncio.run(search(**arguments, headless=True, output_dir=request_dir))
+            self._reply(200, result)
+        except (ValueError, TypeError) as e:
+            self._reply(400, {'error': str(e)})
+        except Exception as e:
+            print(f"[SERVE] ❌ {self.path} failed: {e}")
+            self._reply(500, {'error': f'{type(e).__name__}: {e}'})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve CCLA and EC searches over HTTP')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--output', default='output', help='Output directory')
+    
+    args = parser.parse_args()
+    
+    SearchHandler.output_dir = args.output
+    server = ThreadingHTTPServer((args.host, args.port), SearchHandler)
+    print(f"[SERVE] Listening on http://{args.host}:{args.port} (POST /ccla, POST /ec)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
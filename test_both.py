@@ -7,10 +7,6 @@ import asyncio
 import sys
 from pathlib import Path
 
-# Import the search functions
-from ccla_search import search_ccla
-from registration_search import search_registration
-
 
 async def test_ccla():
     """Test CCLA portal"""
@@ -19,6 +15,9 @@ async def test_ccla():
     print("="*60 + "\n")
     
     try:
+        # Imported per test so each portal only loads its own dependencies
+        from ccla_search import search_ccla
+        
         result = await search_ccla(
             district='31',  # Warangal Rural
             division='67',
@@ -48,6 +47,8 @@ async def test_registration():
     print("="*60 + "\n")
     
     try:
+        from registration_search import search_registration
+        
         result = await search_registration(
             doc_no='1234',
             year='2024',
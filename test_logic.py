@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Offline checks for the pure logic behind the searches: the concurrency
+limiter's AIMD window and circuit breaker, CAPTCHA voting, and the CCLA
+batch scheduler. No browser or network is used.
+
+Usage: python -m unittest test_logic
+"""
+
+import asyncio
+import unittest
+
+from captcha_vote import vote
+from ccla_batch import dropdown_changes, location_of, schedule
+from concurrency import PortalLimiter
+
+
+def query(district='31', division='67', mandal='609', village='3111005', buyer='Kumar'):
+    return {'district': district, 'division': division, 'mandal': mandal, 'village': village, 'buyer': buyer}
+
+
+class LimiterTest(unittest.IsolatedAsyncioTestCase):
+    
+    async def open_circuit(self, limiter):
+        for _ in range(limiter.failure_threshold):
+            await limiter.acquire()
+            await limiter.release(1.0, 'timeout')
+        self.assertEqual(limiter.state, 'open')
+        await asyncio.sleep(limiter.cooldown + 0.02)
+    
+    async def hold_slot(self, limiter):
+        async with limiter.slot():
+            await asyncio.sleep(10)
+    
+    async def test_window_grows_when_fast_and_halves_when_slow(self):
+        limiter = PortalLimiter('test', initial=1, maximum=3, target_latency=10.0)
+        for _ in range(10):
+            await limiter.acquire()
+            await limiter.release(1.0)
+        self.assertEqual(limiter.limit, 3)
+        
+        await limiter.acquire()
+        await limiter.release(20.0)
+        self.assertEqual(limiter.limit, 1)
+    
+    async def test_probe_answered_with_search_failure_closes_circuit(self):
+        limiter = PortalLimiter('test', failure_threshold=1, cooldown=0.05)
+        await self.open_circuit(limiter)
+        
+        async with limiter.slot() as outcome:
+            outcome['error'] = 'No records found'
+        self.assertEqual(limiter.state, 'closed')
+        self.assertFalse(limiter.probing)
+        await asyncio.wait_for(limiter.acquire(), 1)
+    
+    async def test_probe_overload_reopens_with_longer_cooldown(self):
+        limiter = PortalLimiter('test', failure_threshold=1, cooldown=0.05)
+        await self.open_circuit(limiter)
+        
+        with self.assertRaises(RuntimeError):
+            async with limiter.slot():
+                raise RuntimeError('Timeout 30000ms exceeded')
+        self.assertEqual(limiter.state, 'open')
+        self.assertAlmostEqual(limiter.cooldown, 0.1)
+        self.assertEqual(limiter.in_flight, 0)
+    
+    async def test_cancelled_search_frees_its_slot(self):
+        limiter = PortalLimiter('test', initial=1, maximum=1)
+        task = asyncio.ensure_future(self.hold_slot(limiter))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertEqual(len(limiter.outcomes), 0)
+        await asyncio.wait_for(limiter.acquire(), 1)
+    
+    async def test_cancelled_probe_lets_next_search_probe(self):
+        limiter = PortalLimiter('test', failure_threshold=1, cooldown=0.05)
+        await self.open_circuit(limiter)
+        
+        task = asyncio.ensure_future(self.hold_slot(limiter))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        
+        self.assertEqual(limiter.state, 'half_open')
+        self.assertFalse(limiter.probing)
+        await asyncio.wait_for(limiter.acquire(), 1)
+
+
+class VoteTest(unittest.TestCase):
+    
+    def test_unanimous_readings(self):
+        result = vote(['ABC123', 'abc 123', 'ABC123'])
+        self.assertEqual(result['answer'], 'ABC123')
+        self.assertEqual(result['confidence'], 1.0)
+    
+    def test_confusion_pairs_count_as_partial_agreement(self):
+        result = vote(['AB0DEF', 'ABODEF', 'ABDDEF'])
+        self.assertEqual(result['answer'], 'AB0DEF')
+        self.assertAlmostEqual(result['confidence'], 0.667)
+    
+    def test_majority_wins_and_invalid_readings_lower_confidence(self):
+        result = vote(['XK7PQ2', 'XK7PQ2', 'XK7'])
+        self.assertEqual(result['answer'], 'XK7PQ2')
+        self.assertAlmostEqual(result['confidence'], 0.667)
+    
+    def test_no_valid_reading(self):
+        result = vote(['', 'TOO LONG ANSWER', 'AB'])
+        self.assertIsNone(result['answer'])
+        self.assertEqual(result['confidence'], 0.0)
+
+
+class ScheduleTest(unittest.TestCase):
+    
+    def test_dropdown_changes_only_count_differing_levels(self):
+        queries = [query(), query(buyer='Reddy'), query(village='3111006'), query(mandal='610')]
+        # 4 for the first, 0 for the same village, 1 for a new village, 2 for a new mandal
+        self.assertEqual(dropdown_changes(queries), 7)
+        self.assertEqual(dropdown_changes([]), 0)
+    
+    def test_schedule_orders_by_location(self):
+        queries = [query(), query(village='3111006'), query(buyer='Reddy'), query(village='3111006', buyer='Reddy')]
+        runs = schedule(queries, workers=1)
+        self.assertEqual(len(runs), 1)
+        self.assertEqual([location_of(q) for q in runs[0]], sorted(location_of(q) for q in queries))
+        self.assertLess(dropdown_changes(runs[0]), dropdown_changes(queries))
+    
+    def test_schedule_keeps_villages_on_one_worker(self):
+        queries = ([query(village='1')] * 3 + [query(village='2')] * 3
+                   + [query(village='3')] * 1 + [query(village='4')] * 1)
+        runs = schedule(queries, workers=2)
+        self.assertEqual(len(runs), 2)
+        self.assertEqual(sum(map(len, runs)), len(queries))
+        villages = [set(q['village'] for q in run) for run in runs]
+        self.assertFalse(villages[0] & villages[1])
+    
+    def test_schedule_never_uses_more_workers_than_villages_or_asked(self):
+        self.assertEqual(len(schedule([query()] * 5, workers=3)), 1)
+        queries = [query(village=str(i)) for i in range(10)]
+        self.assertEqual(len(schedule(queries, workers=3)), 3)
+        self.assertEqual(schedule([], workers=2), [])
+
+
+if __name__ == '__main__':
+    unittest.main()